@@ -0,0 +1,187 @@
+from rediscache import async_redis_client as r
+from azure.cosmos import exceptions
+from azure.core import MatchConditions
+import entitycache
+import partitionkeys
+from shared_code import queries
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Open auctions scored by their close_date (epoch seconds), so the ones due
+# are a range read instead of a scan over every open auction. Filled by
+# create_auction and kept in sync by changefeed.py.
+SCHEDULE_KEY = "auction_close_schedule"
+# Auctions a scheduler replica is closing, scored by when its claim expires
+CLAIMS_KEY = "auction_close_claims"
+
+# Scheduler (python auctionschedule.py): sleeps until the next deadline, at most TICK seconds
+TICK = float(os.getenv("AUCTION_SCHEDULER_TICK", "1"))
+BATCH_SIZE = int(os.getenv("AUCTION_SCHEDULER_BATCH", "100"))
+CONCURRENCY = int(os.getenv("AUCTION_SCHEDULER_CONCURRENCY", "16"))
+# Claims of a replica that died mid-close become due again after CLAIM_TTL seconds
+CLAIM_TTL = int(os.getenv("AUCTION_SCHEDULER_CLAIM_TTL", "60"))
+RETRY_DELAY = float(os.getenv("AUCTION_SCHEDULER_RETRY_DELAY", "5"))
+# Attempts at the conditional close while bids keep changing the auction
+CLOSE_RETRIES = 5
+
+# Moves up to ARGV[3] due auctions from the schedule to the claims, atomically,
+# so concurrent replicas never claim the same auction. Expired claims first
+# go back to the schedule.
+_claim_script = r.register_script("""
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+end
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[3])
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+    redis.call('ZADD', KEYS[2], ARGV[2], due[i])
+end
+return due
+""")
+
+
+def close_timestamp(auction: dict) -> float:
+    close_date = datetime.datetime.fromisoformat(auction["close_date"])
+    # Dates without an offset are UTC, as close_auctions compares them with utcnow()
+    if close_date.tzinfo is None:
+        close_date = close_date.replace(tzinfo=datetime.timezone.utc)
+    return close_date.timestamp()
+
+
+async def update(auctions: list):
+    """Schedule open auctions and unschedule the others."""
+    pipe = r.pipeline()
+    for auction in auctions:
+        if auction.get("status", "open") == "open":
+            pipe.zadd(SCHEDULE_KEY, {auction["id"]: close_timestamp(auction)})
+        else:
+            pipe.zrem(SCHEDULE_KEY, auction["id"])
+    await pipe.execute()
+
+
+async def closing_soon(limit: int = 10) -> list:
+    if limit <= 0:
+        return []
+    scheduled = await r.zrange(SCHEDULE_KEY, 0, limit - 1, withscores=True)
+    return [
+        {"auction_id": auction_id, "close_date": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()}
+        for auction_id, timestamp in scheduled
+    ]
+
+
+async def claim_due(limit: int) -> list:
+    """[(auction id, close timestamp)] of up to `limit` due auctions, now claimed by this replica."""
+    now = time.time()
+    due = await _claim_script(keys=[SCHEDULE_KEY, CLAIMS_KEY], args=[now, now + CLAIM_TTL, limit])
+    return [(due[i], float(due[i + 1])) for i in range(0, len(due), 2)]
+
+
+async def release(auction_id: str, retry_at: float = None):
+    """Drop a claim; with `retry_at`, schedule the auction again for then."""
+    pipe = r.pipeline()
+    if retry_at is not None:
+        pipe.zadd(SCHEDULE_KEY, {auction_id: retry_at})
+    pipe.zrem(CLAIMS_KEY, auction_id)
+    await pipe.execute()
+
+
+async def close_auction(auctions_container, bids_container, auction_id: str) -> bool:
+    """
+    Close a due auction with an ETag-conditional write. True once the auction
+    is settled (closed now or before, deleted, or rescheduled to a later
+    close_date), False if it should be retried later.
+    """
+    pk = await partitionkeys.resolve("auctions", auction_id, auctions_container)
+    if pk is None:
+        return True
+
+    for _ in range(CLOSE_RETRIES):
+        try:
+            auction = await auctions_container.read_item(item=auction_id, partition_key=pk)
+        except exceptions.CosmosResourceNotFoundError:
+            return True
+        if auction.get("status", "open") != "open":
+            return True
+        if close_timestamp(auction) > time.time():
+            # close_date was moved since it was scheduled
+            await update([auction])
+            return True
+
+        if "bid_count" in auction:
+            # The API keeps the highest bid on the auction itself
+            auction["winner_id"] = auction.get("highest_bidder_id")
+            auction["winning_bid"] = auction.get("highest_bid")
+        else:
+            # Auctions created before the highest bid was materialized
+            bids = await queries.fetch(bids_container, queries.HIGHEST_BID, {"auction_id": auction_id},
+                                       partition_key=auction_id)
+            auction["winner_id"] = bids[0]["bidder_id"] if bids else None
+            auction["winning_bid"] = bids[0]["amount"] if bids else None
+        auction["status"] = "closed"
+        auction["closed_at"] = datetime.datetime.utcnow().isoformat()
+
+        try:
+            auction = await auctions_container.replace_item(
+                item=auction_id, body=auction,
+                etag=auction["_etag"], match_condition=MatchConditions.IfNotModified
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            # A bid or another replica got there first; look again
+            continue
+        if entitycache.ENABLED:
+            await entitycache.put("auctions", auction)
+        logger.info("Auction %s closed. Winner: %s", auction_id, auction.get("winner_id"))
+        return True
+    return False
+
+
+async def run(auctions_container, bids_container):
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def close(auction_id: str):
+        async with slots:
+            try:
+                closed = await close_auction(auctions_container, bids_container, auction_id)
+            except Exception as e:
+                logger.error("Closing auction %s failed: %s", auction_id, e)
+                closed = False
+        await release(auction_id, None if closed else time.time() + RETRY_DELAY)
+
+    while True:
+        due = await claim_due(BATCH_SIZE)
+        if due:
+            lateness = time.time() - min(timestamp for _, timestamp in due)
+            await asyncio.gather(*(close(auction_id) for auction_id, _ in due))
+            logger.info("Processed %d due auctions, up to %.1fs after their close date", len(due), lateness)
+        if len(due) == BATCH_SIZE:
+            continue
+
+        # Wake up for the next deadline, or after TICK to pick up new/expired entries
+        upcoming = await r.zrange(SCHEDULE_KEY, 0, 0, withscores=True)
+        delay = TICK if not upcoming else min(TICK, max(0.0, upcoming[0][1] - time.time()))
+        await asyncio.sleep(delay)
+
+
+async def main():
+    import cosmosdb
+
+    database = await cosmosdb.init_async_database()
+    if database is None:
+        raise RuntimeError("Cosmos DB is not configured")
+    try:
+        await run(database.get_container_client("auctions"), database.get_container_client("bids"))
+    finally:
+        await cosmosdb.close_async_database()
+        await r.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,8 +1,10 @@
 import datetime
 import logging
 import azure.functions as func
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, exceptions
 import os
+from shared_code import queries
 
 COSMOS_ENDPOINT = os.getenv("COSMOS_ENDPOINT")
 COSMOS_KEY = os.getenv("COSMOS_KEY")
@@ -21,40 +23,40 @@ def main(timer: func.TimerRequest) -> None:
     now = datetime.datetime.utcnow().isoformat()
 
     # Get open auctions that should be closed
-    query = f"SELECT * FROM c WHERE c.status='open' AND c.close_date < '{now}'"
-    open_auctions = list(auctions_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
+    open_auctions = queries.fetch_sync(auctions_container, queries.DUE_AUCTIONS, {"now": now},
+                                       enable_cross_partition_query=True)
 
     logging.info(f"Found {len(open_auctions)} auctions to close.")
 
     for auction in open_auctions:
         auction_id = auction["id"]
-        legoset_id = auction["legoset_id"]
-
-        # Find the highest bid for this auction
-        bid_query = f"SELECT * FROM c WHERE c.auction_id='{auction_id}' ORDER BY c.amount DESC"
-        bids = list(bids_container.query_items(
-            query=bid_query,
-            enable_cross_partition_query=True
-        ))
-
-        if bids:
-            winner = bids[0]
-            auction["winner_id"] = winner["bidder_id"]
-            auction["winning_bid"] = winner["amount"]
+
+        if "bid_count" in auction:
+            # The API keeps the highest bid on the auction itself
+            auction["winner_id"] = auction.get("highest_bidder_id")
+            auction["winning_bid"] = auction.get("highest_bid")
         else:
-            auction["winner_id"] = None
-            auction["winning_bid"] = None
+            # Auctions created before the highest bid was materialized
+            bids = queries.fetch_sync(bids_container, queries.HIGHEST_BID, {"auction_id": auction_id},
+                                      partition_key=auction_id)
+            auction["winner_id"] = bids[0]["bidder_id"] if bids else None
+            auction["winning_bid"] = bids[0]["amount"] if bids else None
 
         # Update auction fields
         auction["status"] = "closed"
         auction["closed_at"] = datetime.datetime.utcnow().isoformat()
 
-        # Save the updated auction
-        auctions_container.replace_item(item=auction["id"], body=auction)
+        # Save the updated auction, unless a bid was accepted since we read it;
+        # the next run picks it up again with the new highest bid
+        try:
+            auctions_container.replace_item(
+                item=auction["id"], body=auction,
+                etag=auction["_etag"], match_condition=MatchConditions.IfNotModified
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            logging.info(f"Auction {auction_id} changed while closing; retrying next run")
+            continue
 
         logging.info(f"Auction {auction_id} closed. Winner: {auction.get('winner_id')}")
 
-    logging.info("Auction closing process finished.")
+    logging.info("Auction closing process finished. Queries: %s", queries.snapshot())
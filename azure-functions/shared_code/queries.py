@@ -0,0 +1,134 @@
+from azure.core.async_paging import AsyncItemPaged
+from azure.core.paging import ItemPaged
+import time
+
+# Every Cosmos DB query of the API, the scheduler/change feed scripts and the
+# Azure functions, by name. Values are always passed as @parameters, never
+# formatted into the text: the text of a query is the same for every id, so the
+# SDK and the gateway can reuse its plan, and a value can't change what the
+# query does. The only placeholder is "{select}", filled in with a projection
+# of validated field names (pagination.projection).
+REQUEST_CHARGE_HEADER = "x-ms-request-charge"
+
+
+class Query:
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Query({self.name!r}, {self.text!r})"
+
+    def bind(self, parameters: dict = None, select: str = "*") -> dict:
+        """query_items() arguments: the text, and `parameters` ({"id": ...}) as @parameters."""
+        return {
+            "query": self.text.replace("{select}", select),
+            "parameters": [{"name": f"@{name}", "value": value} for name, value in (parameters or {}).items()],
+        }
+
+
+QUERIES = {}
+
+
+def _define(name: str, text: str) -> Query:
+    QUERIES[name] = Query(name, text)
+    return QUERIES[name]
+
+
+# Whole containers
+ALL = _define("all", "SELECT * FROM c")
+PAGE = _define("page", "SELECT {select} FROM c")
+PARTITION_KEY = _define("partition_key", "SELECT VALUE c.pk FROM c WHERE c.id = @id")
+
+# Legosets
+LEGOSETS_OF_OWNER = _define("legosets_of_owner", "SELECT {select} FROM c WHERE c.owner_id = @owner_id")
+RECENT_LEGOSETS = _define("recent_legosets", "SELECT * FROM c ORDER BY c.created_at DESC OFFSET 0 LIMIT @limit")
+LEGOSET_PHOTOS = _define(
+    "legoset_photos", "SELECT c.id, c.photo_blob_names, c.photo_renditions FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+)
+LEGOSET_NAMES = _define("legoset_names", "SELECT c.id, c.name FROM c")
+
+# Comments (partitioned by legoset_id)
+COMMENTS_OF_LEGOSET = _define("comments_of_legoset", "SELECT {select} FROM c WHERE c.legoset_id = @legoset_id")
+COMMENT_TEXTS = _define("comment_texts", "SELECT c.id, c.legoset_id, c.text, c.polarity, c.created_at FROM c")
+
+# Auctions (partitioned by legoset_id) and bids (partitioned by auction_id)
+AUCTIONS_OF_LEGOSET = _define("auctions_of_legoset", "SELECT * FROM c WHERE c.legoset_id = @legoset_id")
+DUE_AUCTIONS = _define("due_auctions", "SELECT * FROM c WHERE c.status = 'open' AND c.close_date < @now")
+HIGHEST_BID = _define(
+    "highest_bid", "SELECT TOP 1 c.bidder_id, c.amount FROM c WHERE c.auction_id = @auction_id ORDER BY c.amount DESC"
+)
+BID_COUNT = _define("bid_count", "SELECT VALUE COUNT(1) FROM c WHERE c.auction_id = @auction_id")
+
+# Documents of a user being deleted
+COMMENTS_OF_USER = _define("comments_of_user", "SELECT c.id, c.pk FROM c WHERE c.user_id = @user_id")
+AUCTIONS_OF_USER = _define(
+    "auctions_of_user",
+    "SELECT c.id, c.pk, c.seller_id, c.highest_bidder_id FROM c "
+    "WHERE c.seller_id = @user_id OR c.highest_bidder_id = @user_id"
+)
+BIDS_OF_USER = _define("bids_of_user", "SELECT c.id, c.pk FROM c WHERE c.bidder_id = @user_id")
+
+
+# Per query name, in this process: executions, time, request charge and results
+stats = {}
+
+
+def record(name: str, seconds: float, request_charge: float, items: int):
+    entry = stats.setdefault(name, {"executions": 0, "seconds": 0.0, "request_charge": 0.0, "items": 0})
+    entry["executions"] += 1
+    entry["seconds"] += seconds
+    entry["request_charge"] += request_charge
+    entry["items"] += items
+
+
+def snapshot() -> dict:
+    return {
+        name: {
+            **entry,
+            "avg_ms": entry["seconds"] * 1000 / entry["executions"],
+            "avg_request_charge": entry["request_charge"] / entry["executions"],
+        }
+        for name, entry in sorted(stats.items())
+    }
+
+
+class Charge:
+    """A response_hook summing the request charge of a query's pages."""
+    def __init__(self):
+        self.total = 0.0
+
+    def __call__(self, headers, result):
+        # The SDK also calls it once up front, with the pager and a stale response's headers
+        if isinstance(result, (ItemPaged, AsyncItemPaged)):
+            return
+        try:
+            self.total += float((headers or {}).get(REQUEST_CHARGE_HEADER, 0))
+        except (TypeError, ValueError):
+            pass
+
+
+async def fetch(container, query: Query, parameters: dict = None, **options) -> list:
+    """All results of `query`, recorded in `stats`; `options` go to query_items (partition_key, ...)."""
+    charge = Charge()
+    items = []
+    start = time.perf_counter()
+    try:
+        async for item in container.query_items(**query.bind(parameters), response_hook=charge, **options):
+            items.append(item)
+    finally:
+        record(query.name, time.perf_counter() - start, charge.total, len(items))
+    return items
+
+
+def fetch_sync(container, query: Query, parameters: dict = None, **options) -> list:
+    """fetch() for the synchronous client (Azure functions, scripts)."""
+    charge = Charge()
+    items = []
+    start = time.perf_counter()
+    try:
+        for item in container.query_items(**query.bind(parameters), response_hook=charge, **options):
+            items.append(item)
+    finally:
+        record(query.name, time.perf_counter() - start, charge.total, len(items))
+    return items
@@ -1,69 +1,276 @@
-from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ServiceRequestError, ServiceResponseError
+from azure.core.pipeline.transport import AioHttpTransport
+import aiohttp
 from dotenv import load_dotenv
 from fastapi import UploadFile
+import asyncio
+import datetime
+import logging
 import os
+import time
 import uuid
-from typing import List
+from typing import List, Tuple
 import mimetypes
+import io
+import renditions
+import memorybackend
+import metrics
+from urllib.parse import quote
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 STORAGE_CONNECTION_STRING = os.getenv("BLOB_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = "legoset-images"
 
+# Files uploaded at once per request, and blocks uploaded at once per file
+UPLOAD_CONCURRENCY = int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "4"))
+BLOCK_CONCURRENCY = int(os.getenv("BLOB_BLOCK_CONCURRENCY", "2"))
+# Files above MAX_SINGLE_PUT_SIZE are sent as MAX_BLOCK_SIZE blocks
+MAX_SINGLE_PUT_SIZE = int(os.getenv("BLOB_MAX_SINGLE_PUT_SIZE", str(4 * 1024 * 1024)))
+MAX_BLOCK_SIZE = int(os.getenv("BLOB_MAX_BLOCK_SIZE", str(4 * 1024 * 1024)))
+# Whole-file retries on top of the SDK's per-request retries, for transient errors only
+UPLOAD_RETRIES = int(os.getenv("BLOB_UPLOAD_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("BLOB_RETRY_BACKOFF", "0.5"))
+RETRY_STATUS_CODES = {408, 429}
+# Keep-alive connections shared by every request of this process
+CONNECTION_POOL_SIZE = int(os.getenv("BLOB_CONNECTION_POOL_SIZE", "32"))
+# Media URLs are built locally. With BLOB_SAS_TTL (seconds) set they carry a
+# read-only SAS token; BLOB_CDN_BASE_URL (e.g. https://legoapi.azureedge.net)
+# replaces the storage endpoint.
+SAS_TTL = int(os.getenv("BLOB_SAS_TTL", "0"))
+CDN_BASE_URL = os.getenv("BLOB_CDN_BASE_URL", "").rstrip("/")
+URL_CACHE_SIZE = int(os.getenv("MEDIA_URL_CACHE_SIZE", "10000"))
+
+def _is_transient(error: Exception) -> bool:
+    # Connection failures and timeouts, throttling and server errors; anything
+    # else (auth, bad request, ...) fails the same way on every attempt
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code in RETRY_STATUS_CODES or (error.status_code or 0) >= 500
+    return False
+
 class BlobStorageManager:
-    def __init__(self):
-        self.blob_service_client = BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
+    # Async client. The API shares one per process (get_blob_manager()); scripts
+    # can use a short-lived one as `async with BlobStorageManager() as blob_manager:`
+    def __init__(self, transport=None):
+        options = {"transport": transport} if transport else {}
+        if memorybackend.ENABLED:
+            # In-process blobs (STORAGE_BACKEND=memory, see memorybackend.py)
+            self.blob_service_client = memorybackend.blob_service()
+        else:
+            self.blob_service_client = BlobServiceClient.from_connection_string(
+                STORAGE_CONNECTION_STRING,
+                max_single_put_size=MAX_SINGLE_PUT_SIZE,
+                max_block_size=MAX_BLOCK_SIZE,
+                **options
+            )
         self.container_client = self.blob_service_client.get_container_client(CONTAINER_NAME)
-        self._ensure_container_exists()
+        # blob name -> (SAS window, signed url)
+        self._url_cache = {}
+
+    async def __aenter__(self):
+        await self._ensure_container_exists()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
-    def _ensure_container_exists(self):
+    async def close(self):
+        await self.blob_service_client.close()
+
+    async def _ensure_container_exists(self):
         try:
-            self.blob_service_client.create_container(CONTAINER_NAME, public_access="blob")
+            await self.blob_service_client.create_container(CONTAINER_NAME, public_access="blob")
         except ResourceExistsError:
             pass
 
-    def upload_image(self, file: UploadFile, legoset_id: str) -> str:
+    async def upload_image(self, file: UploadFile, legoset_id: str) -> str:
         # Get file extension
         _, extension = os.path.splitext(file.filename)
-        
+
         # Generate unique blob name
         blob_name = f"{legoset_id}/{str(uuid.uuid4())}{extension}"
-        
+
         # Get content type
         content_type = file.content_type or mimetypes.guess_type(file.filename)[0]
-        
-        # Upload directly from memory
-        self.container_client.upload_blob(
-            name=blob_name,
-            data=file.file,
-            content_type=content_type,
-            overwrite=True
-        )
-        
+
+        # Stream from the spooled upload; large files go up in parallel blocks
+        await self._upload_blob(blob_name, file.file, file.size, content_type)
         return blob_name
 
-    def upload_legoset_images(self, files: List[UploadFile], legoset_id: str) -> List[str]:
-        uploaded_files = []
-        for file in files:
+    async def _upload_blob(self, blob_name: str, data, length: int, content_type: str):
+        for attempt in range(UPLOAD_RETRIES):
             try:
-                blob_name = self.upload_image(file, legoset_id)
-                uploaded_files.append(blob_name)
+                data.seek(0)
+                with metrics.timed("blob"):
+                    await self.container_client.upload_blob(
+                        name=blob_name,
+                        data=data,
+                        length=length,
+                        content_type=content_type,
+                        overwrite=True,
+                        max_concurrency=BLOCK_CONCURRENCY
+                    )
+                return
             except Exception as e:
-                print(f"Failed to upload {file.filename}: {e}")
-        return uploaded_files
-    
+                if attempt == UPLOAD_RETRIES - 1 or not _is_transient(e):
+                    raise
+                logger.warning("Retrying upload of %s after %r", blob_name, e)
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def upload_photo(self, file: UploadFile, legoset_id: str) -> dict:
+        """
+        Upload a photo and its downscaled renditions (see renditions.py), as
+        {"original": blob name, "medium": ..., "thumbnail": ...}. Renditions are
+        stored next to the original as `{name}_{rendition}.jpg`; sizes the photo
+        is already smaller than are left out.
+        """
+        if not renditions.ENABLED:
+            return {"original": await self.upload_image(file, legoset_id)}
+
+        await file.seek(0)
+        data = await file.read()
+        # The original goes up while the renditions are being rendered
+        blob_name, rendered = await asyncio.gather(
+            self.upload_image(file, legoset_id),
+            renditions.render_async(data),
+            return_exceptions=True
+        )
+        if isinstance(blob_name, BaseException):
+            raise blob_name
+        if isinstance(rendered, BaseException):
+            await self._delete_uploaded([blob_name])
+            raise rendered
+
+        base, _ = os.path.splitext(blob_name)
+        names = {name: f"{base}_{name}.jpg" for name in rendered}
+        # Every upload is awaited, so none lands after the cleanup below
+        results = await asyncio.gather(*(
+            self._upload_blob(names[name], io.BytesIO(jpeg), len(jpeg), "image/jpeg")
+            for name, jpeg in rendered.items()
+        ), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Don't leave the original (or the other renditions) behind without a document pointing to them
+            await self._delete_uploaded(
+                [blob_name] + [names[name] for name, result in zip(rendered, results) if result is None]
+            )
+            raise errors[0]
+        return {"original": blob_name, **names}
+
+    async def _delete_uploaded(self, blob_names: List[str]):
+        # Best effort; the caller reports the upload's own error
+        results = await asyncio.gather(*(self.delete_image(name) for name in blob_names), return_exceptions=True)
+        for name, result in zip(blob_names, results):
+            if isinstance(result, Exception):
+                logger.warning("Could not delete %s after a failed upload: %r", name, result)
+
+    async def upload_legoset_images(self, files: List[UploadFile], legoset_id: str) -> Tuple[List[dict], List[dict]]:
+        """
+        Upload all files with their renditions concurrently (at most
+        UPLOAD_CONCURRENCY files at a time). Returns the upload_photo() result of
+        every file, in the order of `files`, and a list of {"filename", "error"}
+        for the files that failed after all retries.
+        """
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def upload(file: UploadFile):
+            async with semaphore:
+                return await self.upload_photo(file, legoset_id)
+
+        results = await asyncio.gather(*(upload(file) for file in files), return_exceptions=True)
+
+        uploaded_files, failed_files = [], []
+        for file, result in zip(files, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to upload %s: %r", file.filename, result)
+                failed_files.append({"filename": file.filename, "error": str(result)})
+            else:
+                uploaded_files.append(result)
+        return uploaded_files, failed_files
+
+    def _unsigned_url(self, blob_name: str) -> str:
+        base = f"{CDN_BASE_URL}/{CONTAINER_NAME}" if CDN_BASE_URL else self.container_client.url
+        return f"{base}/{quote(blob_name, safe='~/')}"
+
     def get_image_url(self, blob_name: str) -> str:
-        blob_client = self.container_client.get_blob_client(blob_name)
-        return blob_client.url
+        """URL of a blob, without any request to storage."""
+        credential = self.blob_service_client.credential
+        if not SAS_TTL or credential is None:
+            return self._unsigned_url(blob_name)
+
+        # Tokens expire at the end of the window after the current one, so a
+        # blob's URL stays the same (and browser/CDN cacheable) for a whole
+        # window and is valid for at least SAS_TTL seconds when handed out
+        window = int(time.time()) // SAS_TTL
+        cached = self._url_cache.get(blob_name)
+        if cached and cached[0] == window:
+            return cached[1]
+
+        sas = generate_blob_sas(
+            account_name=credential.account_name,
+            container_name=CONTAINER_NAME,
+            blob_name=blob_name,
+            account_key=credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.datetime.fromtimestamp((window + 2) * SAS_TTL, datetime.timezone.utc)
+        )
+        url = f"{self._unsigned_url(blob_name)}?{sas}"
+        if len(self._url_cache) >= URL_CACHE_SIZE:
+            # Drop the oldest entry
+            del self._url_cache[next(iter(self._url_cache))]
+        self._url_cache[blob_name] = (window, url)
+        return url
+
+    def get_image_urls(self, blob_names: List[str]) -> List[str]:
+        return [self.get_image_url(blob_name) for blob_name in blob_names]
 
-    def delete_image(self, blob_name: str):
+    async def delete_image(self, blob_name: str):
         blob_client = self.container_client.get_blob_client(blob_name)
-        blob_client.delete_blob()
+        with metrics.timed("blob"):
+            await blob_client.delete_blob()
 
-    def delete_legoset_images(self, legoset_id: str):
+    async def delete_legoset_images(self, legoset_id: str):
         prefix = f"{legoset_id}/"
-        blobs = self.container_client.list_blobs(name_starts_with=prefix)
-        for blob in blobs:
-            self.delete_image(blob.name)
\ No newline at end of file
+        with metrics.timed("blob"):
+            names = [blob.name async for blob in self.container_client.list_blobs(name_starts_with=prefix)]
+        for name in names:
+            await self.delete_image(name)
+
+
+_blob_manager = None
+_session = None
+
+
+def get_blob_manager() -> BlobStorageManager:
+    """The process-wide manager; created on first use, without any network call."""
+    global _blob_manager, _session
+    if _blob_manager is None and memorybackend.ENABLED:
+        _blob_manager = BlobStorageManager()
+    elif _blob_manager is None:
+        if not STORAGE_CONNECTION_STRING:
+            raise ValueError("BLOB_STORAGE_CONNECTION_STRING is not set")
+        # Must be called from the event loop the manager will be used on
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTION_POOL_SIZE))
+        _blob_manager = BlobStorageManager(transport=AioHttpTransport(session=_session, session_owner=False))
+    return _blob_manager
+
+
+async def init_blob_storage():
+    # The container only has to be checked once per process, not per request
+    await get_blob_manager()._ensure_container_exists()
+
+
+async def close_blob_storage():
+    global _blob_manager, _session
+    if _blob_manager is not None:
+        await _blob_manager.close()
+    if _session is not None:
+        await _session.close()
+    _blob_manager = None
+    _session = None
@@ -0,0 +1,94 @@
+from dotenv import load_dotenv
+import orjson
+import os
+import time
+import zstandard
+
+load_dotenv()
+
+# Cached list entries (see entitycache.single_flight) are
+#   v{FORMAT_VERSION} {codec} {delta} {expiry}\n{body}
+# where the body is the JSON payload, zstd-compressed once it reaches
+# COMPRESS_MIN_BYTES. The payload stays JSON so a hit is sent to the client
+# as is; decompressing it is far cheaper than re-encoding it would be.
+# Entries in any other format are treated as misses, so bump FORMAT_VERSION
+# whenever the layout changes.
+FORMAT_VERSION = 1
+COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "16384"))
+ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+_version = f"v{FORMAT_VERSION}".encode()
+
+
+def encode(payload: bytes, delta: float, expiry: float) -> bytes:
+    if len(payload) >= COMPRESS_MIN_BYTES:
+        codec, body = "zstd", _compressor.compress(payload)
+    else:
+        codec, body = "json", payload
+    return f"v{FORMAT_VERSION} {codec} {delta} {expiry}\n".encode() + body
+
+
+def parse_header(entry: bytes):
+    """(codec, delta, expiry, body), or None if the entry isn't in this format."""
+    header, _, body = entry.partition(b"\n")
+    fields = header.split()
+    if len(fields) != 4 or fields[0] != _version or fields[1] not in (b"json", b"zstd"):
+        return None
+    return fields[1].decode(), float(fields[2]), float(fields[3]), body
+
+
+def decode(entry: bytes):
+    """(delta, expiry, JSON payload), or None if the entry isn't in this format."""
+    parsed = parse_header(entry)
+    if parsed is None:
+        return None
+    codec, delta, expiry, body = parsed
+    return delta, expiry, _decompressor.decompress(body) if codec == "zstd" else body
+
+
+def report(client) -> list:
+    """Bytes stored and decode time of every cached list entry."""
+    rows = []
+    for key in client.scan_iter(match="*:*", count=1000, _type="string"):
+        entry = client.get(key)
+        parsed = parse_header(entry) if entry else None
+        if parsed is None:
+            continue
+        start = time.perf_counter()
+        _, _, payload = decode(entry)
+        decode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        orjson.loads(payload)
+        parse_time = time.perf_counter() - start
+        try:
+            stored = client.memory_usage(key)
+        except Exception:
+            stored = None
+        rows.append({
+            "key": key.decode(),
+            "codec": parsed[0],
+            "entry_bytes": len(entry),
+            "json_bytes": len(payload),
+            "redis_memory": stored,
+            "decode_ms": decode_time * 1000,
+            "json_parse_ms": parse_time * 1000,
+        })
+    return sorted(rows, key=lambda row: row["entry_bytes"], reverse=True)
+
+
+if __name__ == "__main__":
+    import redis
+    from rediscache import connection_options
+
+    rows = report(redis.Redis(**{**connection_options, "decode_responses": False}))
+    # stored: entry size; memory: Redis MEMORY USAGE; decode: decompression;
+    # parse: orjson.loads of the payload, paid only by include_urls requests
+    print(f"{'key':<40} {'codec':<5} {'stored':>10} {'memory':>10} {'json':>10} {'ratio':>6} {'decode':>9} {'parse':>9}")
+    for row in rows:
+        memory = f"{row['redis_memory']:,}" if row["redis_memory"] else "-"
+        print(f"{row['key']:<40} {row['codec']:<5} {row['entry_bytes']:>10,} {memory:>10} {row['json_bytes']:>10,} "
+              f"{row['json_bytes'] / row['entry_bytes']:>5.1f}x {row['decode_ms']:>7.2f}ms {row['json_parse_ms']:>7.2f}ms")
+    if not rows:
+        print("No cached list entries")
@@ -0,0 +1,153 @@
+from rediscache import async_redis_client as r
+from azure.cosmos import exceptions
+import auctionschedule
+import cosmosdb
+import sentiment
+import sentimentindex
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Keeps derived state up to date from the Cosmos DB change feed, instead of
+# timer functions rescanning whole containers: every cycle reads only what
+# changed since each container's checkpoint, so its cost follows the write rate.
+#   comments -> sentiment index (GET /rest/legoset/most-liked)
+#   legosets -> names in the sentiment index
+#   auctions -> close schedule (auctionschedule.py, GET /rest/auction/closing-soon)
+#
+# Run one or more replicas: python changefeed.py
+# Each container is processed by whichever replica holds its lease; the others
+# take over once it stops renewing it. Checkpoints are written after a page is
+# handled, so a crash replays that page - every handler is idempotent.
+PROCESSOR = os.getenv("CHANGEFEED_PROCESSOR", "derived-state")
+POLL = float(os.getenv("CHANGEFEED_POLL", "2"))
+PAGE_SIZE = int(os.getenv("CHANGEFEED_PAGE_SIZE", "500"))
+LEASE_TTL = int(os.getenv("CHANGEFEED_LEASE_TTL", "30"))
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Takes the lease if it is free, renews it if we hold it
+_acquire_script = r.register_script("""
+local owner = redis.call('GET', KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+""")
+
+
+def lease_key(container_name: str) -> str:
+    return f"changefeed:{PROCESSOR}:{container_name}:lease"
+
+
+def checkpoint_key(container_name: str) -> str:
+    return f"changefeed:{PROCESSOR}:{container_name}:checkpoint"
+
+
+async def acquire_lease(container_name: str) -> bool:
+    return bool(await _acquire_script(keys=[lease_key(container_name)], args=[OWNER, LEASE_TTL]))
+
+
+async def apply_comments(comments: list, legosets_container):
+    # Comments written before scoring-on-write (or by other writers) are scored here in one batch
+    unscored = [c for c in comments if c.get("polarity") is None]
+    for comment, polarity in zip(unscored, sentiment.polarities(c["text"] for c in unscored)):
+        comment["polarity"] = float(polarity)
+
+    # Names of legosets not ranked yet; comments of deleted legosets are dropped
+    legoset_ids = list({comment["legoset_id"] for comment in comments})
+    pipe = r.pipeline()
+    for legoset_id in legoset_ids:
+        pipe.hget(sentimentindex.stats_key(legoset_id), "name")
+    names = dict(zip(legoset_ids, await pipe.execute()))
+    for legoset_id in [legoset_id for legoset_id, name in names.items() if name is None]:
+        try:
+            legoset = await legosets_container.read_item(item=legoset_id, partition_key="LEGOSET")
+            names[legoset_id] = legoset["name"]
+        except exceptions.CosmosResourceNotFoundError:
+            del names[legoset_id]
+
+    for comment in comments:
+        if comment["legoset_id"] in names:
+            await sentimentindex.record_comment(
+                comment["legoset_id"], comment["id"], comment["polarity"], names[comment["legoset_id"]],
+                sentimentindex.created_timestamp(comment)
+            )
+
+
+async def apply_legosets(legosets: list):
+    for legoset in legosets:
+        await sentimentindex.rename_legoset(legoset["id"], legoset["name"])
+
+
+async def apply_auctions(auctions: list):
+    await auctionschedule.update(auctions)
+
+
+async def process(container_name: str, container, handler) -> int:
+    """Hand every change since the checkpoint to `handler`, page by page; returns the number of changes."""
+    if not await acquire_lease(container_name):
+        return 0
+
+    checkpoint = await r.get(checkpoint_key(container_name))
+    # Without a checkpoint, start from the beginning: the handlers are idempotent
+    start = {"continuation": checkpoint} if checkpoint else {"start_time": "Beginning"}
+    pages = container.query_items_change_feed(max_item_count=PAGE_SIZE, **start).by_page()
+    changes = 0
+    async for page in pages:
+        documents = [document async for document in page]
+        if documents:
+            await handler(documents)
+            changes += len(documents)
+        if not await acquire_lease(container_name):
+            # Taken over while we were handling the page; the new owner replays it
+            logger.warning("Lost the %s lease", container_name)
+            return changes
+        if pages.continuation_token:
+            await r.set(checkpoint_key(container_name), pages.continuation_token)
+    return changes
+
+
+async def run(database, once: bool = False):
+    legosets_container = database.get_container_client("legosets")
+    feeds = [
+        # Legosets first, so comments on a new legoset find its name
+        ("legosets", legosets_container, apply_legosets),
+        ("comments", database.get_container_client("comments"),
+         lambda comments: apply_comments(comments, legosets_container)),
+        ("auctions", database.get_container_client("auctions"), apply_auctions),
+    ]
+    while True:
+        for name, container, handler in feeds:
+            try:
+                changes = await process(name, container, handler)
+                if changes:
+                    logger.info("Applied %d %s changes", changes, name)
+            except Exception as e:
+                # Retried from the last checkpoint next cycle
+                logger.error("Processing %s changes failed: %s", name, e)
+        if once:
+            return
+        await asyncio.sleep(POLL)
+
+
+async def main(once: bool = False):
+    database = await cosmosdb.init_async_database()
+    if database is None:
+        raise RuntimeError("Cosmos DB is not configured")
+    try:
+        await run(database, once)
+    finally:
+        await cosmosdb.close_async_database()
+        await r.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(once="--once" in sys.argv))
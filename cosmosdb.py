@@ -1,7 +1,9 @@
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 from dotenv import load_dotenv
 import os
 import logging
+import memorybackend
 
 load_dotenv()
 
@@ -14,7 +16,10 @@ logger = logging.getLogger(__name__)
 client = None
 database = None
 
-if COSMOS_ENDPOINT and COSMOS_KEY and DATABASE_NAME:
+if memorybackend.ENABLED:
+    # In-process containers (STORAGE_BACKEND=memory, see memorybackend.py)
+    database = memorybackend.get_database(DATABASE_NAME or "legodb")
+elif COSMOS_ENDPOINT and COSMOS_KEY and DATABASE_NAME:
     try:
         client = CosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
         database = client.create_database_if_not_exists(
@@ -37,4 +42,30 @@ if COSMOS_ENDPOINT and COSMOS_KEY and DATABASE_NAME:
         database = None
 else:
     logger.warning("COSMOS_ENDPOINT/COSMOS_KEY/DATABASE_NAME not fully set; skipping Cosmos DB initialization")
-    
\ No newline at end of file
+    
+
+# Async client used by the API; the containers are created by the sync
+# initialization above, so this one only has to connect.
+async_client = None
+async_database = None
+
+
+async def init_async_database():
+    global async_client, async_database
+    if database is None:
+        return None
+    if memorybackend.ENABLED:
+        # Already async
+        async_database = database
+        return async_database
+    async_client = AsyncCosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
+    async_database = async_client.get_database_client(DATABASE_NAME)
+    return async_database
+
+
+async def close_async_database():
+    global async_client, async_database
+    if async_client is not None:
+        await async_client.close()
+    async_client = None
+    async_database = None
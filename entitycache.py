@@ -0,0 +1,315 @@
+from rediscache import async_redis_client as r, async_redis_raw_client as raw
+import cachecodec
+import localcache
+import metrics
+import redis
+import asyncio
+import functools
+import logging
+import math
+import orjson
+import os
+import random
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Entities are written through on every mutation, so they can live much
+# longer than list keys; the TTL only bounds drift from writers that bypass
+# the API (populate_db, the azure functions).
+ENTITY_TTL = int(os.getenv("ENTITY_CACHE_TTL", "600"))
+LIST_TTL = int(os.getenv("LIST_CACHE_TTL", "60"))
+# Point reads of ids that don't exist (or were deleted) are remembered this long
+NEGATIVE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+# Stored in an entity key in place of the entity; a later put simply overwrites it
+_TOMBSTONE = "null"
+
+# Single-flight recompute lock and how long other workers wait for its result
+LOCK_TTL_MS = int(os.getenv("CACHE_LOCK_TTL_MS", "5000"))
+LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "0.5"))
+LOCK_POLL = 0.025
+# The last computed value of each list is kept this many TTLs for waiters
+STALE_FACTOR = 10
+
+# Turned off by main.CACHING
+ENABLED = True
+
+ENTITY_PREFIXES = {
+    "users": "user",
+    "legosets": "legoset",
+    "auctions": "auction",
+}
+
+# Cosmos system properties and secrets never go into the cache
+_SKIPPED_FIELDS = {"_rid", "_self", "_etag", "_attachments", "_ts", "password"}
+
+
+def entity_key(collection: str, id: str) -> str:
+    return f"{ENTITY_PREFIXES[collection]}:{id}"
+
+
+def _ids_key(collection: str) -> str:
+    return f"{collection}:ids"
+
+
+def _complete_key(collection: str) -> str:
+    return f"{collection}:complete"
+
+
+def _version_key(collection: str) -> str:
+    return f"{collection}:version"
+
+
+def _clean(doc: dict) -> dict:
+    return {k: v for k, v in doc.items() if k not in _SKIPPED_FIELDS}
+
+
+async def version(collection: str) -> int:
+    return int(await r.get(_version_key(collection)) or 0)
+
+
+async def list_key(collection: str, name: str, ver: int = None) -> str:
+    # List keys embed the collection version, so a mutation expires them all at once
+    if ver is None:
+        ver = await version(collection)
+    return f"{name}:v{ver}"
+
+
+async def get(collection: str, id: str):
+    cached = await r.get(entity_key(collection, id))
+    return orjson.loads(cached) if cached else None
+
+
+async def get_many(collection: str, ids: list) -> list:
+    """Cached entities for `ids`, in order, with None for the ones not cached."""
+    if not ids:
+        return []
+    cached = await r.mget([entity_key(collection, id) for id in ids])
+    return [orjson.loads(item) if item else None for item in cached]
+
+
+async def put(collection: str, doc: dict):
+    """Write one created/updated entity through to Redis and invalidate the collection's lists."""
+    key = entity_key(collection, doc["id"])
+    localcache.invalidate(key)
+    pipe = r.pipeline()
+    pipe.setex(key, ENTITY_TTL, orjson.dumps(_clean(doc)))
+    pipe.sadd(_ids_key(collection), doc["id"])
+    pipe.incr(_version_key(collection))
+    pipe.publish(localcache.INVALIDATION_CHANNEL, key)
+    await pipe.execute()
+
+
+async def delete(collection: str, id: str):
+    key = entity_key(collection, id)
+    localcache.invalidate(key)
+    pipe = r.pipeline()
+    pipe.setex(key, NEGATIVE_TTL, _TOMBSTONE)
+    pipe.srem(_ids_key(collection), id)
+    pipe.incr(_version_key(collection))
+    pipe.publish(localcache.INVALIDATION_CHANNEL, key)
+    await pipe.execute()
+
+
+async def cache_entity(collection: str, doc: dict):
+    # Read-through fill of a single entity; no list invalidation needed
+    await r.setex(entity_key(collection, doc["id"]), ENTITY_TTL, orjson.dumps(_clean(doc)))
+
+
+async def read_model(collection: str, id: str, model, load):
+    """
+    An entity as a validated `model`, from this worker's L1 cache (localcache.py),
+    then Redis, then `await load()` (Cosmos; None when it doesn't exist).
+    Misses are cached as well, for NEGATIVE_TTL seconds or until the entity is put.
+    The returned object may be shared with other requests and must not be modified.
+    """
+    if not ENABLED:
+        doc = await load()
+        return model(**doc) if doc is not None else None
+
+    key = entity_key(collection, id)
+    family = ENTITY_PREFIXES[collection]
+    value = localcache.get(key)
+    metrics.cache_lookup("l1", family, "miss" if value is None else "hit")
+    if value is localcache.MISSING:
+        return None
+    if value is not None:
+        return value
+
+    read_generation = localcache.generation()
+    cached = await r.get(key)
+    metrics.cache_lookup("redis", family, "hit" if cached else "miss")
+    if cached == _TOMBSTONE:
+        localcache.put(key, localcache.MISSING, read_generation)
+        return None
+    if cached:
+        doc = orjson.loads(cached)
+    else:
+        doc = await load()
+        if doc is None:
+            # nx: a create that raced with this read has already cached the entity
+            await r.set(key, _TOMBSTONE, ex=NEGATIVE_TTL, nx=True)
+            localcache.put(key, localcache.MISSING, read_generation)
+            return None
+        await cache_entity(collection, doc)
+    value = model(**doc)
+    localcache.put(key, value, read_generation)
+    return value
+
+
+async def get_all(collection: str):
+    """Every entity of a collection from the per-entity keys, or None if the cache isn't complete."""
+    family = _complete_key(collection)
+    if not await r.exists(_complete_key(collection)):
+        metrics.cache_lookup("redis", family, "miss")
+        return None
+    ids = await r.smembers(_ids_key(collection))
+    if not ids:
+        metrics.cache_lookup("redis", family, "hit")
+        return []
+    cached = await r.mget([entity_key(collection, id) for id in ids])
+    if any(item is None or item == _TOMBSTONE for item in cached):
+        # Some entity expired; the next reader reloads the collection
+        await r.delete(_complete_key(collection))
+        metrics.cache_lookup("redis", family, "miss")
+        return None
+    metrics.cache_lookup("redis", family, "hit")
+    return [orjson.loads(item) for item in cached]
+
+
+async def fill(collection: str, docs: list, ver: int):
+    """Cache a full collection load, unless it was mutated since `ver` was read."""
+    version_key = _version_key(collection)
+    async with r.pipeline() as pipe:
+        try:
+            await pipe.watch(version_key)
+            if int(await pipe.get(version_key) or 0) != ver:
+                return
+            pipe.multi()
+            pipe.delete(_ids_key(collection))
+            for doc in docs:
+                pipe.setex(entity_key(collection, doc["id"]), ENTITY_TTL, orjson.dumps(_clean(doc)))
+            if docs:
+                pipe.sadd(_ids_key(collection), *[doc["id"] for doc in docs])
+            pipe.setex(_complete_key(collection), ENTITY_TTL, 1)
+            await pipe.execute()
+        except redis.WatchError:
+            logger.info("Skipped caching %s: collection changed while loading", collection)
+
+
+async def load_collection(collection: str, load):
+    """All entities of a collection from the per-entity keys, falling back to `await load()` (Cosmos)."""
+    ver = await version(collection)
+    docs = await get_all(collection)
+    if docs is None:
+        docs = await load()
+        await fill(collection, docs, ver)
+    return docs
+
+
+# Releases a lock only if we still own it (it may have expired and been re-taken)
+_release_script = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+async def _acquire(lock_key: str):
+    token = uuid.uuid4().hex
+    if await r.set(lock_key, token, nx=True, px=LOCK_TTL_MS):
+        return token
+    return None
+
+
+async def _store(key: str, stale_key: str, payload: bytes, delta: float, ttl: int):
+    # Compressed above a size threshold, see cachecodec.py
+    entry = cachecodec.encode(payload, delta, time.time() + ttl)
+    pipe = raw.pipeline()
+    pipe.setex(key, ttl, entry)
+    pipe.setex(stale_key, ttl * STALE_FACTOR, entry)
+    await pipe.execute()
+
+
+def _expired_early(delta: float, expiry: float, beta: float) -> bool:
+    # Probabilistic early expiration ("XFetch"): the closer to expiry and the
+    # slower the recompute, the more likely one reader refreshes ahead of time
+    return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expiry
+
+
+def single_flight(collection: str, name: str, ttl: int = None, beta: float = 1.0):
+    """
+    Cache a list endpoint under `{name}:v{collection version}`, where `name` is
+    formatted with the endpoint's keyword arguments (e.g. "recent_legosets:{limit}").
+    The decorated function returns its value serialized to JSON bytes, so cache
+    hits can be sent as they are stored, without decoding and re-encoding.
+
+    Only one worker across all processes/pods recomputes a missing value; it
+    holds a short Redis lock while the others get the last known (stale) value,
+    or wait up to LOCK_WAIT seconds for the fresh one when there is none. Values
+    are also refreshed probabilistically shortly before they expire.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> bytes:
+            if not ENABLED:
+                return orjson.dumps(await func(*args, **kwargs))
+
+            list_ttl = ttl or LIST_TTL
+            base = name.format(**kwargs)
+            # e.g. "recent_legosets" for recent_legosets:{limit}
+            family = name.split(":")[0]
+            key = await list_key(collection, base)
+            stale_key = f"{base}:stale"
+            lock_key = f"lock:{key}"
+
+            async def recompute(token):
+                try:
+                    start = time.monotonic()
+                    payload = orjson.dumps(await func(*args, **kwargs))
+                    await _store(key, stale_key, payload, time.monotonic() - start, list_ttl)
+                    return payload
+                finally:
+                    await _release_script(keys=[lock_key], args=[token])
+
+            # Entries in an older format decode to None and count as misses
+            cached = await raw.get(key)
+            cached = cachecodec.decode(cached) if cached else None
+            if cached:
+                metrics.cache_lookup("redis", family, "hit")
+                delta, expiry, payload = cached
+                if _expired_early(delta, expiry, beta):
+                    token = await _acquire(lock_key)
+                    if token:
+                        return await recompute(token)
+                return payload
+
+            token = await _acquire(lock_key)
+            if token:
+                metrics.cache_lookup("redis", family, "miss")
+                return await recompute(token)
+
+            # Someone else is recomputing: serve the last known value if there
+            # is one, otherwise wait briefly for theirs
+            stale = await raw.get(stale_key)
+            stale = cachecodec.decode(stale) if stale else None
+            if stale:
+                metrics.cache_lookup("redis", family, "stale")
+                return stale[2]
+
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL)
+                cached = await raw.get(key)
+                cached = cachecodec.decode(cached) if cached else None
+                if cached:
+                    metrics.cache_lookup("redis", family, "hit")
+                    return cached[2]
+
+            # Cold cache and the recompute is slow; compute without caching
+            metrics.cache_lookup("redis", family, "miss")
+            return orjson.dumps(await func(*args, **kwargs))
+        return wrapper
+    return decorator
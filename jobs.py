@@ -0,0 +1,109 @@
+from rediscache import async_redis_client as r
+import asyncio
+import datetime
+import logging
+import orjson
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Background jobs started by a request and run on the worker that received it.
+# Their state lives in Redis so any worker can answer GET /rest/job/{id}.
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+# One job per kind and subject at a time. The lock is refreshed on every progress
+# update, so a job whose worker died stops blocking retries after LOCK_TTL seconds.
+LOCK_TTL = int(os.getenv("JOB_LOCK_TTL", "300"))
+
+_tasks = set()
+
+# The lock holds the id of the job that owns it. A job only refreshes or releases
+# its own lock: after LOCK_TTL it may have been taken over by a retry.
+_refresh_script = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+_release_script = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _lock_key(kind: str, subject: str) -> str:
+    return f"job:{kind}:{subject}:lock"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+async def get(job_id: str):
+    state = await r.get(_job_key(job_id))
+    return orjson.loads(state) if state else None
+
+
+async def _save(state: dict):
+    await r.setex(_job_key(state["id"]), JOB_TTL, orjson.dumps(state))
+
+
+async def start(kind: str, subject: str, work) -> dict:
+    """
+    Run `await work(progress)` in the background and return the job's state.
+    `progress(**counts)` records counts in the state. If a job of the same kind
+    is already running for `subject`, its state is returned instead.
+    """
+    job_id = str(uuid.uuid4())
+    lock = _lock_key(kind, subject)
+    if not await r.set(lock, job_id, nx=True, ex=LOCK_TTL):
+        running = await get(await r.get(lock) or "")
+        if running is not None:
+            return running
+        await r.set(lock, job_id, ex=LOCK_TTL)
+
+    state = {
+        "id": job_id, "kind": kind, "subject": subject, "status": "running",
+        "progress": {}, "error": None, "created_at": _now(), "finished_at": None,
+    }
+    await _save(state)
+    task = asyncio.get_running_loop().create_task(_run(state, lock, work))
+    # The loop only keeps weak references to tasks
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return dict(state)
+
+
+async def _run(state: dict, lock: str, work):
+    async def progress(**counts):
+        state["progress"].update(counts)
+        await _save(state)
+        await _refresh_script(keys=[lock], args=[state["id"], LOCK_TTL])
+
+    try:
+        await work(progress)
+        state["status"] = "succeeded"
+    except asyncio.CancelledError:
+        state["status"] = "interrupted"
+        raise
+    except Exception as e:
+        logger.exception("Job %s %s (%s) failed", state["kind"], state["subject"], state["id"])
+        state["status"] = "failed"
+        state["error"] = str(e)
+    finally:
+        state["finished_at"] = _now()
+        await _save(state)
+        await _release_script(keys=[lock], args=[state["id"]])
+
+
+async def stop():
+    # Cancelled jobs are marked "interrupted"; their work must be safe to start again
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from rediscache import async_redis_client as r
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Per-worker LRU cache of validated models in front of the Redis entity cache.
+# Entries live at most TTL seconds; writes anywhere evict them through Redis
+# pub/sub, the TTL only bounds staleness from writers that bypass the API.
+MAX_SIZE = int(os.getenv("L1_CACHE_SIZE", "10000"))
+TTL = float(os.getenv("L1_CACHE_TTL", "30"))
+INVALIDATION_CHANNEL = "entitycache:invalidate"
+POLL = 1.0
+
+_entries = OrderedDict()  # key -> (expiry, value)
+# Cached in place of a value for entities known not to exist
+MISSING = object()
+# Bumped on every invalidation, so a read that raced with one doesn't store its stale value
+_generation = 0
+_listener = None
+# Also checked by the listener: a client that swallows the cancellation while
+# polling (fakeredis on Python 3.11 can) would otherwise keep stop() waiting
+_stopping = False
+
+stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+
+def generation() -> int:
+    return _generation
+
+
+def get(key: str):
+    entry = _entries.get(key)
+    if entry is None:
+        stats["misses"] += 1
+        return None
+    if entry[0] <= time.monotonic():
+        del _entries[key]
+        stats["expirations"] += 1
+        stats["misses"] += 1
+        return None
+    _entries.move_to_end(key)
+    stats["hits"] += 1
+    return entry[1]
+
+
+def put(key: str, value, read_generation: int):
+    """Cache `value`, unless something was invalidated since `read_generation` was taken."""
+    if MAX_SIZE <= 0 or read_generation != _generation:
+        return
+    _entries[key] = (time.monotonic() + TTL, value)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_SIZE:
+        _entries.popitem(last=False)
+        stats["evictions"] += 1
+
+
+def invalidate(key: str):
+    global _generation
+    _generation += 1
+    if _entries.pop(key, None) is not None:
+        stats["invalidations"] += 1
+
+
+def clear():
+    global _generation
+    _generation += 1
+    _entries.clear()
+
+
+def snapshot() -> dict:
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "size": len(_entries),
+        "max_size": MAX_SIZE,
+        "hit_rate": stats["hits"] / lookups if lookups else None,
+    }
+
+
+async def _listen():
+    while not _stopping:
+        pubsub = r.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Invalidations published while we weren't subscribed are lost
+            clear()
+            while not _stopping:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL)
+                if message and message["type"] == "message":
+                    invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("L1 cache invalidation listener failed, resubscribing: %s", e)
+            clear()
+            await asyncio.sleep(POLL)
+        finally:
+            await pubsub.close()
+
+
+def start():
+    global _listener
+    if _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+
+async def stop():
+    global _listener, _stopping
+    if _listener is not None:
+        _stopping = True
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _stopping = False
+    _listener = None
+    clear()
@@ -1,43 +1,161 @@
-import json
+import orjson
 from typing import Union
+from collections import defaultdict
+import asyncio
 import datetime
 from models import *
-from utils import hash_password, verify_password
-from rediscache import redis_client as r
+import utils
+from rediscache import async_redis_client as r, async_redis_raw_client as raw_r
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 import uuid
 from azure.cosmos import exceptions
-from blobstorage import BlobStorageManager
-from textblob import TextBlob
+from azure.cosmos.partition_key import NonePartitionKeyValue
+from azure.core import MatchConditions
+import blobstorage
+import cosmosdb
+import partitionkeys
+import pagination
+from shared_code import queries
+import sentimentindex
+import auctionschedule
+import renditions
+import entitycache
+import jobs
+import localcache
+import metrics
 import logging
+import os
+import re
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# orjson for every response; cached lists skip serialization altogether (json_bytes_response)
+app = FastAPI(default_response_class=ORJSONResponse)
+# Per-route latency, Cosmos DB request charge, dependency calls and cache hits (GET /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
 COSMOS_DB_AVAILABLE = False
 users_container = legosets_container = comments_container = auctions_container = bids_container = None
 
-try:
-    from cosmosdb import database
-    if database:
-        users_container = database.get_container_client("users")
-        legosets_container = database.get_container_client("legosets")
-        comments_container = database.get_container_client("comments")
-        auctions_container = database.get_container_client("auctions")
-        bids_container = database.get_container_client("bids")
-        COSMOS_DB_AVAILABLE = True
-        logger.info("Cosmos DB initialized successfully")
-    else:
-        logger.warning("Cosmos DB database is None")
-except Exception as e:
-    logger.error(f"Failed to initialize Cosmos DB: {e}")
+# Cosmos DB allows at most 100 operations per transactional batch
+BATCH_SIZE = 100
+BATCH_CONCURRENCY = int(os.getenv("COSMOS_BATCH_CONCURRENCY", "8"))
 
 def ensure_db_available():
     if not COSMOS_DB_AVAILABLE:
         raise HTTPException(status_code=503, detail="Cosmos DB not available")
 
+async def read_or_404(container, id: str, partition_key: str, detail: str):
+    try:
+        return await container.read_item(item=id, partition_key=partition_key)
+    except exceptions.CosmosResourceNotFoundError:
+        raise HTTPException(status_code=404, detail=detail)
+
+async def patch_in_batches(container, patches: list, on_batch=None) -> list:
+    """
+    Apply (item, patch operations) pairs as transactional batches, grouped by the
+    items' partition key and run concurrently. Returns the patched documents.
+    """
+    by_partition = defaultdict(list)
+    for item, operations in patches:
+        # Legacy bids have no pk (see migrate_bids_pk.py)
+        by_partition[item.get("pk", NonePartitionKeyValue)].append(("patch", (item["id"], operations)))
+    batches = [
+        (pk, operations[i:i + BATCH_SIZE])
+        for pk, operations in by_partition.items()
+        for i in range(0, len(operations), BATCH_SIZE)
+    ]
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(pk, operations):
+        async with slots:
+            results = await container.execute_item_batch(batch_operations=operations, partition_key=pk)
+        if on_batch:
+            await on_batch(len(operations))
+        return [result["resourceBody"] for result in results if result.get("resourceBody")]
+
+    patched = await asyncio.gather(*(run(pk, operations) for pk, operations in batches))
+    return [doc for docs in patched for doc in docs]
+
+def json_bytes_response(payload: bytes) -> Response:
+    # Already serialized (entitycache.single_flight), e.g. straight from Redis
+    return Response(content=payload, media_type="application/json")
+
+async def read_model_or_404(collection: str, container, id: str, partition_key: str, model, detail: str):
+    # Hot point reads: served from the worker's L1 cache, then Redis, then Cosmos
+    async def load():
+        try:
+            return await container.read_item(item=id, partition_key=partition_key)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+    value = await entitycache.read_model(collection, id, model, load)
+    if value is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return value
+
 CACHING = True
+entitycache.ENABLED = CACHING
+
+# Async clients are bound to the server's event loop, so they are created on startup
+@app.on_event("startup")
+async def init_clients():
+    global COSMOS_DB_AVAILABLE, users_container, legosets_container, comments_container, auctions_container, bids_container
+    try:
+        database = await cosmosdb.init_async_database()
+        if database:
+            users_container = metrics.CosmosContainer(database.get_container_client("users"))
+            legosets_container = metrics.CosmosContainer(database.get_container_client("legosets"))
+            comments_container = metrics.CosmosContainer(database.get_container_client("comments"))
+            auctions_container = metrics.CosmosContainer(database.get_container_client("auctions"))
+            bids_container = metrics.CosmosContainer(database.get_container_client("bids"))
+            COSMOS_DB_AVAILABLE = True
+            logger.info("Cosmos DB initialized successfully")
+        else:
+            logger.warning("Cosmos DB database is None")
+    except Exception as e:
+        logger.error(f"Failed to initialize Cosmos DB: {e}")
+
+    try:
+        await blobstorage.init_blob_storage()
+    except Exception as e:
+        logger.error(f"Failed to initialize Blob storage: {e}")
+
+    if CACHING:
+        # Evicts L1 entries written by other workers/pods
+        localcache.start()
+
+@app.on_event("shutdown")
+async def close_clients():
+    await localcache.stop()
+    await jobs.stop()
+    await cosmosdb.close_async_database()
+    await blobstorage.close_blob_storage()
+    renditions.shutdown()
+    utils.shutdown()
+    await r.close()
+    await raw_r.close()
+
+# A second registration of the same method and path is never reached (the
+# first one wins routing), which once silently bypassed the cached get_user
+@app.on_event("startup")
+async def check_unique_routes():
+    seen = {}
+    duplicates = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        # /rest/user/{id} and /rest/user/{user_id} match the same requests
+        path = re.sub(r"\{[^}:]*(:[^}]*)?\}", r"{\1}", route.path)
+        for method in route.methods:
+            if (method, path) in seen:
+                duplicates.append(f"{method} {route.path} ({seen[method, path]} and {route.name})")
+            seen[method, path] = route.name
+    if duplicates:
+        raise RuntimeError(f"Duplicate routes: {'; '.join(duplicates)}")
 
 # Default deleted user
 @app.on_event("startup")
@@ -45,13 +163,13 @@ async def ensure_deleted_user_exists():
     if not COSMOS_DB_AVAILABLE:
         logger.warning("Skipping deleted user creation - Cosmos DB not available")
         return
-    
+
     deleted_user_id = "deleted-user"
     try:
-        users_container.read_item(item=deleted_user_id, partition_key="USER")
+        await users_container.read_item(item=deleted_user_id, partition_key="USER")
         logger.info("Deleted user already exists")
     except exceptions.CosmosResourceNotFoundError:
-        users_container.create_item({
+        await users_container.create_item({
             "id": deleted_user_id,
             "pk": "USER",
             "nickname": "Deleted User",
@@ -64,12 +182,35 @@ async def ensure_deleted_user_exists():
         print("Created default 'Deleted User'")
 
 
+# Bulk export, registered before the /rest/user/{id} style routes
+@app.get("/rest/{collection}/export")
+async def export_collection(collection: str, cursor: Optional[str] = None, checkpoints: bool = False):
+    ensure_db_available()
+    exports = {
+        "user": (users_container, UserOutput),
+        "legoset": (legosets_container, LegoSetOutput),
+        "auction": (auctions_container, AuctionOut),
+    }
+    if collection not in exports:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {collection}")
+    container, model = exports[collection]
+    return StreamingResponse(
+        pagination.export_ndjson(container, model, cursor, checkpoints),
+        media_type="application/x-ndjson"
+    )
+
+
 # User
 @app.post("/rest/user")
-def create_user(user: UserCreate):    
+async def create_user(user: UserCreate):
     ensure_db_available()
     user_id = uuid.uuid4()
-    hashed_password = hash_password(user.password)
+    # Argon2 is CPU bound; it runs in utils' bounded hashing pool
+    try:
+        hashed_password = await utils.hash_password_async(user.password)
+    except utils.PasswordHashingBusy:
+        raise HTTPException(status_code=503, detail="Too many signups in progress, retry shortly",
+                            headers={"Retry-After": "1"})
     user.password = hashed_password
     new_user = {
         "id": str(user_id),
@@ -80,110 +221,183 @@ def create_user(user: UserCreate):
         **user.dict()
     }
 
-    users_container.create_item(new_user)
+    await users_container.create_item(new_user)
+    if CACHING:
+        await entitycache.put("users", new_user)
     return new_user
 
+# List endpoints return the full list by default; passing `limit`, `cursor`
+# or `fields` switches them to one page: {"items": [...], "next_cursor": ...}
 @app.get("/rest/user")
-def list_users():
+async def list_users(limit: pagination.Limit = None, cursor: Optional[str] = None, fields: Optional[str] = None):
     ensure_db_available()
-    if CACHING:
-        cached_users = r.get("users_list")
-        if cached_users:
-            return json.loads(cached_users)
-    query = "SELECT * FROM c"
-    users = list(users_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-    users = [UserOutput(**user) for user in users]
-    if CACHING:
-        r.setex("users_list", 60, json.dumps([user.model_dump() for user in users]))
-    return users
+    if pagination.is_paged(limit, cursor, fields):
+        return await pagination.query_page(users_container, UserOutput, queries.PAGE, limit, cursor, fields)
+    return json_bytes_response(await list_all_users())
+
+@entitycache.single_flight("users", "users_list")
+async def list_all_users():
+    async def load():
+        return await queries.fetch(users_container, queries.ALL)
+
+    users = await entitycache.load_collection("users", load) if CACHING else await load()
+    return [UserOutput(**user).model_dump() for user in users]
 
 @app.get("/rest/user/{id}")
-def get_user(id: str):
-    try:
-        user = users_container.read_item(item=id, partition_key="USER")
-        return UserOutput(**user)
-    except exceptions.CosmosResourceNotFoundError:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def get_user(id: str):
+    ensure_db_available()
+    # Read-through L1/Redis; 404s are cached too, see entitycache.read_model
+    return await read_model_or_404("users", users_container, id, "USER", UserOutput, "User not found")
+
 @app.put("/rest/user/{id}")
-def update_user(id: str, updated_user: UserUpdate):
+async def update_user(id: str, updated_user: UserUpdate):
     try:
-        user = users_container.read_item(item=id, partition_key="USER")
-        
+        user = await users_container.read_item(item=id, partition_key="USER")
+
         updated_data = updated_user.dict(exclude_unset=True)
         user.update(updated_data)
-        
-        users_container.replace_item(item=id, body=user)
+
+        await users_container.replace_item(item=id, body=user)
+        if CACHING:
+            await entitycache.put("users", user)
         return user
     except exceptions.CosmosResourceNotFoundError:
         raise HTTPException(status_code=404, detail="User not found")
-    
-@app.delete("/rest/user/{id}")
-def delete_user(id: str):
-    try:
-        users_container.read_item(item=id, partition_key="USER")
-
-        # Update all comments made by deleted user
-        comment_query = f"SELECT * FROM c WHERE c.user_id = '{id}'"
-        comments = list(comments_container.query_items(
-            query=comment_query, enable_cross_partition_query=True
-        ))
-        for comment in comments:
-            comment["user_id"] = "deleted-user"
-            comments_container.replace_item(item=comment["id"], body=comment)
-
-        # Update all auctions
-        auction_query = f"SELECT * FROM c WHERE c.seller_id = '{id}'"
-        auctions = list(auctions_container.query_items(
-            query=auction_query, enable_cross_partition_query=True
-        ))
-        for auction in auctions:
-            auction["seller_id"] = "deleted-user"
-            auctions_container.replace_item(item=auction["id"], body=auction)
-
-        # Update all bids
-        bid_query = f"SELECT * FROM c WHERE c.bidder_id = '{id}'"
-        bids = list(bids_container.query_items(
-            query=bid_query, enable_cross_partition_query=True
-        ))
-        for bid in bids:
-            bid["bidder_id"] = "deleted-user"
-            bids_container.replace_item(item=bid["id"], body=bid)
-
-        # Delete the user
-        users_container.delete_item(item=id, partition_key="USER")
-
-        return {"status": f"User {id} deleted successfully"}
 
+@app.delete("/rest/user/{id}", status_code=202)
+async def delete_user(id: str):
+    ensure_db_available()
+    await read_or_404(users_container, id, "USER", "User not found")
+    # Re-attributing everything the user wrote can take a while; the request
+    # returns right away and the job reports its progress at /rest/job/{job_id}
+    job = await jobs.start("delete_user", id, lambda progress: reattribute_and_delete_user(id, progress))
+    return {**job, "status_url": f"/rest/job/{job['id']}"}
+
+async def reattribute_and_delete_user(id: str, progress):
+    # Patches are idempotent, so a failed or interrupted job can simply run again
+    parameters = {"user_id": id}
+    comments, auctions, bids = await asyncio.gather(
+        queries.fetch(comments_container, queries.COMMENTS_OF_USER, parameters),
+        queries.fetch(auctions_container, queries.AUCTIONS_OF_USER, parameters),
+        queries.fetch(bids_container, queries.BIDS_OF_USER, parameters),
+    )
+    await progress(comments=len(comments), auctions=len(auctions), bids=len(bids), patched=0)
+
+    def reassign(*fields):
+        return [{"op": "set", "path": f"/{field}", "value": "deleted-user"} for field in fields]
+
+    patched = 0
+
+    async def on_batch(count: int):
+        nonlocal patched
+        patched += count
+        await progress(patched=patched)
+
+    _, patched_auctions, _ = await asyncio.gather(
+        patch_in_batches(comments_container, [(comment, reassign("user_id")) for comment in comments], on_batch),
+        patch_in_batches(auctions_container, [
+            (auction, reassign(*(field for field in ("seller_id", "highest_bidder_id") if auction.get(field) == id)))
+            for auction in auctions
+        ], on_batch),
+        patch_in_batches(bids_container, [(bid, reassign("bidder_id")) for bid in bids], on_batch),
+    )
+    if CACHING:
+        for auction in patched_auctions:
+            await entitycache.put("auctions", auction)
+
+    try:
+        await users_container.delete_item(item=id, partition_key="USER")
     except exceptions.CosmosResourceNotFoundError:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-@app.get("/rest/media/{blob_name}")
-def get_media_url(blob_name: str):
+        pass  # deleted by an earlier run of this job
+    if CACHING:
+        await entitycache.delete("users", id)
+
+@app.get("/rest/job/{job_id}")
+async def get_job(job_id: str):
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/rest/media/{blob_name:path}")
+async def get_media_url(blob_name: str):
     try:
-        # Initialize blob storage manager
-        blob_manager = BlobStorageManager()
-        
         # Get the URL for the blob
-        url = blob_manager.get_image_url(blob_name)
+        url = blobstorage.get_blob_manager().get_image_url(blob_name)
         return {"url": url, "blob_name": blob_name}
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Image not found: {str(e)}")
 
+IMAGE_SIZES = ["original", *renditions.SIZES]
+
+def check_image_size(image_size: str):
+    if image_size not in IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"image_size must be one of: {', '.join(IMAGE_SIZES)}")
+
+def photo_renditions(legoset: dict) -> list:
+    # One {rendition: blob name} per photo; photos uploaded before renditions
+    # existed (or replaced through PUT) only have the original
+    names = legoset.get("photo_blob_names") or []
+    photos = legoset.get("photo_renditions") or []
+    if len(photos) != len(names):
+        photos = [{} for _ in names]
+    return [{**photo, "original": name} for name, photo in zip(names, photos)]
+
+def with_photo_urls(legosets: list, image_size: str = "original") -> list:
+    # Resolved per response and never cached, as signed URLs expire
+    blob_manager = blobstorage.get_blob_manager()
+    return [
+        {**legoset, "photo_urls": blob_manager.get_image_urls(
+            [photo.get(image_size, photo["original"]) for photo in photo_renditions(legoset)]
+        )}
+        if legoset.get("photo_blob_names") is not None else legoset
+        for legoset in legosets
+    ]
+
+# Media URLs of every photo of the given legosets (comma separated ids), in one call
+@app.get("/rest/legoset/media")
+async def get_legosets_media(ids: str):
+    legoset_ids = list(dict.fromkeys(id.strip() for id in ids.split(",") if id.strip()))
+    if not legoset_ids:
+        raise HTTPException(status_code=400, detail="No legoset ids given")
+    if len(legoset_ids) > pagination.MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {pagination.MAX_PAGE_SIZE} legosets per request")
+
+    cached = await entitycache.get_many("legosets", legoset_ids) if CACHING else []
+    photos = {legoset["id"]: photo_renditions(legoset) for legoset in cached if legoset}
+    missing = [id for id in legoset_ids if id not in photos]
+    if missing:
+        legosets = await queries.fetch(legosets_container, queries.LEGOSET_PHOTOS, {"ids": missing},
+                                       partition_key="LEGOSET")
+        photos.update((legoset["id"], photo_renditions(legoset)) for legoset in legosets)
+
+    blob_manager = blobstorage.get_blob_manager()
+    return {
+        "legosets": [
+            LegoSetMediaOutput(legoset_id=id, media=[
+                MediaOutput(
+                    blob_name=photo["original"],
+                    url=blob_manager.get_image_url(photo["original"]),
+                    renditions={size: blob_manager.get_image_url(name) for size, name in photo.items()}
+                )
+                for photo in photos[id]
+            ])
+            for id in legoset_ids if id in photos
+        ],
+        "not_found": [id for id in legoset_ids if id not in photos],
+    }
+
 # LegoSet
 @app.post("/rest/legoset")
-def create_legoset(
+async def create_legoset(
         name: str = Form(...),
         code_number: str = Form(...),
         description: Optional[str] = Form(None),
         owner_id: Optional[str] = Form(None),
         files: List[UploadFile] = File(...)
-    ): 
-    blob_manager = BlobStorageManager()
-    photo_blob_names = blob_manager.upload_legoset_images(files, code_number)
+    ):
+    blob_manager = blobstorage.get_blob_manager()
+    photos, failed_uploads = await blob_manager.upload_legoset_images(files, code_number)
     lego_set_id = uuid.uuid4()
     new_lego_set = {
         "id": str(lego_set_id),
@@ -191,189 +405,169 @@ def create_legoset(
         "pk": "LEGOSET",
         "code_number": code_number,
         "description": description,
-        "photo_blob_names": photo_blob_names,
+        "photo_blob_names": [photo["original"] for photo in photos],
+        "photo_renditions": photos,
         "created_at": datetime.datetime.now().isoformat(),
         "owner_id": owner_id,
     }
-    legosets_container.create_item(new_lego_set)
+    await legosets_container.create_item(new_lego_set)
+    if CACHING:
+        await entitycache.put("legosets", new_lego_set)
+    if failed_uploads:
+        return {**new_lego_set, "failed_uploads": failed_uploads}
     return new_lego_set
 
 
 @app.get("/rest/legoset")
-def list_legosets():
-    if CACHING:
-        cached_legoset = r.get("legosets_list")
-        if cached_legoset:
-            return json.loads(cached_legoset)
-    query = "SELECT * FROM c"
-    legosets = list(legosets_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-    legosets = [LegoSetOutput(**legoset) for legoset in legosets]
-    if CACHING:
-        r.setex("legosets_list", 60, json.dumps([legoset.model_dump() for legoset in legosets]))
-    return legosets
+async def list_legosets(limit: pagination.Limit = None, cursor: Optional[str] = None, fields: Optional[str] = None,
+                        include_urls: bool = False, image_size: str = "original"):
+    check_image_size(image_size)
+    if pagination.is_paged(limit, cursor, fields):
+        page = await pagination.query_page(legosets_container, LegoSetOutput, queries.PAGE, limit, cursor, fields)
+        if include_urls:
+            page.items = with_photo_urls(page.items, image_size)
+        return page
+    payload = await list_all_legosets()
+    if include_urls:
+        return with_photo_urls(orjson.loads(payload), image_size)
+    return json_bytes_response(payload)
+
+@entitycache.single_flight("legosets", "legosets_list")
+async def list_all_legosets():
+    async def load():
+        return await queries.fetch(legosets_container, queries.ALL)
+
+    legosets = await entitycache.load_collection("legosets", load) if CACHING else await load()
+    return [LegoSetOutput(**legoset).model_dump() for legoset in legosets]
 
 
-@app.get("/rest/user/{id}")
-def get_user(id: str):
-    if CACHING:
-        cached_user = r.get(f"user:{id}")
-        if cached_user:
-            return UserOutput(**json.loads(cached_user))
-
-    try:
-        user = users_container.read_item(item=id, partition_key="USER")
-    except exceptions.CosmosResourceNotFoundError:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    user_output = UserOutput(**user)
-
-    if CACHING:
-        r.setex(f"user:{id}", 60, json.dumps(user_output.model_dump()))
-
-    return user_output
-
 @app.put("/rest/legoset/{id}")
-def update_legoset(id: str, updated_legoset: LegoSetUpdate):
+async def update_legoset(id: str, updated_legoset: LegoSetUpdate):
     try:
-        legoset = legosets_container.read_item(item=id, partition_key="LEGOSET")
+        legoset = await legosets_container.read_item(item=id, partition_key="LEGOSET")
         updated_data = updated_legoset.dict(exclude_unset=True)
+        if "photo_blob_names" in updated_data and "photo_renditions" not in updated_data:
+            # Renditions of the replaced photos no longer apply
+            updated_data["photo_renditions"] = None
         legoset.update(updated_data)
-        legosets_container.replace_item(item=id, body=legoset)
+        await legosets_container.replace_item(item=id, body=legoset)
+        if CACHING:
+            await entitycache.put("legosets", legoset)
+        if "name" in updated_data:
+            await sentimentindex.rename_legoset(id, legoset["name"])
         return legoset
     except exceptions.CosmosResourceNotFoundError:
-        return {"error": "Lego set not found"}        
+        return {"error": "Lego set not found"}
 
 @app.delete("/rest/legoset/{id}")
-def delete_legoset(id: str):
+async def delete_legoset(id: str):
     try:
-        legosets_container.delete_item(item=id, partition_key="LEGOSET")
+        await legosets_container.delete_item(item=id, partition_key="LEGOSET")
+        await sentimentindex.remove_legoset(id)
+        if CACHING:
+            await entitycache.delete("legosets", id)
         return {"status": "Lego set deleted successfully"}
     except exceptions.CosmosResourceNotFoundError:
         return {"error": "Lego set not found"}
 
 # List of LegoSets of a given user
 @app.get("/rest/user/{user_id}/legosets")
-def list_legosets_of_user(user_id: str):
-    query = f"SELECT * FROM c WHERE c.owner_id = '{user_id}'"
-    legosets = list(legosets_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-    legosets = [LegoSetOutput(**legoset) for legoset in legosets]
-    return legosets
+async def list_legosets_of_user(user_id: str, limit: pagination.Limit = None, cursor: Optional[str] = None,
+                                fields: Optional[str] = None, include_urls: bool = False,
+                                image_size: str = "original"):
+    check_image_size(image_size)
+    if pagination.is_paged(limit, cursor, fields):
+        page = await pagination.query_page(
+            legosets_container, LegoSetOutput, queries.LEGOSETS_OF_OWNER,
+            limit, cursor, fields, parameters={"owner_id": user_id}
+        )
+        if include_urls:
+            page.items = with_photo_urls(page.items, image_size)
+        return page
+    legosets = await queries.fetch(legosets_container, queries.LEGOSETS_OF_OWNER, {"owner_id": user_id})
+    legosets = [LegoSetOutput(**legoset).model_dump() for legoset in legosets]
+    return with_photo_urls(legosets, image_size) if include_urls else legosets
 
 # List of most recently added LegoSets
 @app.post("/rest/legoset/recent")
-def list_recent_legosets(limit: int = 10):
-    cache_key = f"recent_legosets:{limit}"
-
-    if CACHING:
-        cached = r.get(cache_key)
-        if cached:
-            return [LegoSetOutput(**item) for item in json.loads(cached)]
-
-    query = f"SELECT * FROM c ORDER BY c.created_at DESC OFFSET 0 LIMIT {limit}"
-    legosets = list(legosets_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
+async def list_recent_legosets(limit: pagination.Limit = 10, include_urls: bool = False, image_size: str = "original"):
+    check_image_size(image_size)
+    payload = await recent_legosets(limit=limit)
+    if include_urls:
+        return with_photo_urls(orjson.loads(payload), image_size)
+    return json_bytes_response(payload)
+
+@entitycache.single_flight("legosets", "recent_legosets:{limit}")
+async def recent_legosets(limit: int = 10):
+    # Derived from the full legoset entity cache when it is complete,
+    # otherwise from the (cheaper) top-N query
+    legosets = await entitycache.get_all("legosets") if CACHING else None
+    if legosets is None:
+        legosets = await queries.fetch(legosets_container, queries.RECENT_LEGOSETS, {"limit": limit})
 
     if not legosets:
         raise HTTPException(status_code=404, detail="No Lego sets found")
 
-    legosets_output = [LegoSetOutput(**legoset) for legoset in legosets]
-
-    if CACHING:
-        r.setex(cache_key, 60, json.dumps([item.model_dump() for item in legosets_output]))
-
-    return legosets_output
+    legosets = sorted(legosets, key=lambda legoset: legoset.get("created_at") or "", reverse=True)
+    return [LegoSetOutput(**legoset).model_dump() for legoset in legosets[:limit]]
 
 # list most liked LegoSets
 @app.get("/rest/legoset/most-liked")
-def get_most_liked_legosets(limit: int = 10):
-    legosets = list(legosets_container.query_items(
-        query="SELECT * FROM c",
-        enable_cross_partition_query=True
-    ))
-
-    liked_scores = []
-
-    for legoset in legosets:
-        legoset_id = legoset["id"]
-        comments = list(comments_container.query_items(
-            query=f"SELECT * FROM c WHERE c.legoset_id='{legoset_id}'",
-            enable_cross_partition_query=True
-        ))
-        if not comments:
-            continue
-        score = sum(TextBlob(c["text"]).sentiment.polarity for c in comments) / len(comments)
-        liked_scores.append({
-            "legoset_id": legoset_id,
-            "name": legoset["name"],
-            "score": score
-        })
-
-    liked_scores.sort(key=lambda x: x["score"], reverse=True)
-    return liked_scores[:limit]
+async def get_most_liked_legosets(limit: pagination.Limit = 10):
+    # Served from the incrementally maintained sentiment index (see sentimentindex.py)
+    return await sentimentindex.top_legosets(limit)
 
 # Comments
 @app.post("/rest/legoset/{id}/comment")
-def create_comment(id: str, comment: CommentCreate):
-    # check if legoset exists
-    try:
-        legoset = legosets_container.read_item(item=id, partition_key="LEGOSET")
-    except:
-        raise HTTPException(status_code=404, detail="Lego set not found")
-    #check if user exists
-    try: # ?????
-        user = users_container.read_item(item=comment.user_id, partition_key="USER")
-    except:
-        raise HTTPException(status_code=404, detail="User not found")
+async def create_comment(id: str, comment: CommentCreate):
+    if comment.legoset_id != id:
+        raise HTTPException(status_code=400, detail="legoset_id does not match the Lego set in the path")
+    # check if legoset and user exist
+    legoset, user = await asyncio.gather(
+        read_model_or_404("legosets", legosets_container, id, "LEGOSET", LegoSetOutput, "Lego set not found"),
+        read_model_or_404("users", users_container, comment.user_id, "USER", UserOutput, "User not found"),
+    )
     # create the comment
     comment_id = uuid.uuid4()
     new_comment = {
         "id": str(comment_id),
-        "pk": comment.legoset_id, # the comments get saved closer to the legoset
+        "pk": id, # the comments get saved closer to the legoset
         "user_id": comment.user_id, # ?????
-        "legoset_id": comment.legoset_id,
+        "legoset_id": id,
         "text": comment.text,
+        "polarity": sentimentindex.score_text(comment.text), # scored once, on write
         "created_at": datetime.datetime.now().isoformat(),
     }
-    comments_container.create_item(new_comment)
+    await comments_container.create_item(new_comment)
+    await sentimentindex.record_comment(id, new_comment["id"], new_comment["polarity"], legoset.name)
     return new_comment
 
 @app.get("/rest/legoset/{id}/comment")
-def list_comments(id: str): 
-    try:
-        legoset = legosets_container.read_item(item=id, partition_key="LEGOSET")
-    except:
-        raise HTTPException(status_code=404, detail="Lego set not found")
-
-    query = f"SELECT * FROM c WHERE c.legoset_id='{id}'" 
-    comments = list(comments_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
+async def list_comments(id: str, limit: pagination.Limit = None, cursor: Optional[str] = None,
+                        fields: Optional[str] = None):
+    await read_model_or_404("legosets", legosets_container, id, "LEGOSET", LegoSetOutput, "Lego set not found")
+
+    if pagination.is_paged(limit, cursor, fields):
+        return await pagination.query_page(
+            comments_container, CommentOut, queries.COMMENTS_OF_LEGOSET,
+            limit, cursor, fields, parameters={"legoset_id": id}, partition_key=id
+        )
+
+    # Comments are partitioned by their legoset
+    comments = await queries.fetch(comments_container, queries.COMMENTS_OF_LEGOSET, {"legoset_id": id}, partition_key=id)
     comments = [CommentOut(**comment) for comment in comments]
     return comments
 
 # Auction
 @app.post("/rest/auction")
-def create_auction(auction: AuctionCreate):
-    # check if legoset exists
-    try:
-        legoset = legosets_container.read_item(item=auction.legoset_id, partition_key="LEGOSET")
-    except:
-        raise HTTPException(status_code=404, detail="Lego set not found")
-    # check if user exists
-    try: # ?????
-        user = users_container.read_item(item=auction.seller_id, partition_key="USER")
-    except:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def create_auction(auction: AuctionCreate):
+    # check if legoset and user exist
+    await asyncio.gather(
+        read_model_or_404("legosets", legosets_container, auction.legoset_id, "LEGOSET", LegoSetOutput,
+                          "Lego set not found"),
+        read_model_or_404("users", users_container, auction.seller_id, "USER", UserOutput, "User not found"),
+    )
+
     auction_id = uuid.uuid4()
     new_auction = {
         "id": str(auction_id),
@@ -383,80 +577,159 @@ def create_auction(auction: AuctionCreate):
         "base_price": float(auction.base_price),
         "close_date": auction.close_date.isoformat(),
         "status": "open",  # Add initial status
+        # Materialized highest bid, maintained by bid_auction
+        "highest_bid": None,
+        "highest_bidder_id": None,
+        "bid_count": 0,
         "created_at": datetime.datetime.now().isoformat()
-    } 
-    auctions_container.create_item(new_auction)
+    }
+    await auctions_container.create_item(new_auction)
+    await partitionkeys.remember("auctions", new_auction["id"], new_auction["pk"])
+    # Closed on time by the scheduler (python auctionschedule.py)
+    await auctionschedule.update([new_auction])
+    if CACHING:
+        await entitycache.put("auctions", new_auction)
     return new_auction
 
 @app.get("/rest/auction")
-def list_auctions(): 
-    query = "SELECT * FROM c"
-    auctions = list(auctions_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-    auctions = [AuctionOut(**auction) for auction in auctions]
-    return auctions
+async def list_auctions(limit: pagination.Limit = None, cursor: Optional[str] = None, fields: Optional[str] = None):
+    if pagination.is_paged(limit, cursor, fields):
+        return await pagination.query_page(auctions_container, AuctionOut, queries.PAGE, limit, cursor, fields)
+    return json_bytes_response(await list_all_auctions())
+
+@entitycache.single_flight("auctions", "auctions_list")
+async def list_all_auctions():
+    async def load():
+        return await queries.fetch(auctions_container, queries.ALL)
+
+    auctions = await entitycache.load_collection("auctions", load) if CACHING else await load()
+    return [AuctionOut(**auction).model_dump() for auction in auctions]
+
+# Open auctions by close date, from the close schedule
+@app.get("/rest/auction/closing-soon")
+async def list_auctions_closing_soon(limit: pagination.Limit = 10):
+    return await auctionschedule.closing_soon(limit)
 
 # Search Auctions for a given LegoSet
 @app.post("/rest/auction/search")
-def search_auctions_by_legoset(legoset_id: str):
-    query = f"SELECT * FROM c WHERE c.legoset_id = '{legoset_id}'"
-    auctions = list(auctions_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
+async def search_auctions_by_legoset(legoset_id: str):
+    # Auctions are partitioned by their legoset
+    auctions = await queries.fetch(auctions_container, queries.AUCTIONS_OF_LEGOSET, {"legoset_id": legoset_id},
+                                   partition_key=legoset_id)
     if not auctions:
         raise HTTPException(status_code=404, detail="No auctions found for this Lego set")
     auctions = [AuctionOut(**auction) for auction in auctions]
     return auctions
 
 # Bid
-@app.post("/rest/auction/{id}/bid")
-def bid_auction(id: str, bid: BidCreate):
-    # check if auction exists
-    query = f"SELECT * FROM c WHERE c.id = '{id}'"
-    results = list(auctions_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-
-    if not results:
+# Attempts at the conditional auction update before giving up under contention
+BID_RETRIES = 5
+
+async def materialize_highest_bid(auction: dict):
+    # Auctions created before the highest bid was stored on them
+    # Bids are partitioned by their auction
+    parameters = {"auction_id": auction["id"]}
+    bids, counts = await asyncio.gather(
+        queries.fetch(bids_container, queries.HIGHEST_BID, parameters, partition_key=auction["id"]),
+        queries.fetch(bids_container, queries.BID_COUNT, parameters, partition_key=auction["id"]),
+    )
+    auction["highest_bid"] = bids[0]["amount"] if bids else None
+    auction["highest_bidder_id"] = bids[0]["bidder_id"] if bids else None
+    auction["bid_count"] = counts[0] if counts else 0
+
+async def read_auction(id: str):
+    # Point read in the auction's partition (keyed by legoset_id) instead of a cross-partition scan
+    pk = await partitionkeys.resolve("auctions", id, auctions_container)
+    if pk is None:
         raise HTTPException(status_code=404, detail="Auction not found")
-
-    #check if user exists
-    try: # ?????
-        user = users_container.read_item(item=bid.bidder_id, partition_key="USER")
-    except:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    auction = results[0]
-
-    # get bids to check the highest amount
-    query = f"SELECT * FROM c WHERE c.auction_id='{id}' ORDER BY c.amount DESC" 
-    bids = list(bids_container.query_items(
-        query=query,
-        enable_cross_partition_query=True
-    ))
-
-    if bids:
-        highest_bid = bids[0]["amount"]
-        # refuse request if the bid is too small
-        if float(bid.amount) <= float(highest_bid):
-            raise HTTPException(status_code=403, detail="Bid amount is too small")
-    if float(auction["base_price"]) > float(bid.amount):
+    return await read_or_404(auctions_container, id, pk, "Auction not found")
+
+def check_bid(auction: dict, amount: float):
+    # Past its close_date an auction takes no bids, even before the scheduler closed it
+    if auction.get("status", "open") != "open" or auctionschedule.close_timestamp(auction) <= time.time():
+        raise HTTPException(status_code=403, detail="Auction is closed")
+    # refuse request if the bid is too small
+    if auction["highest_bid"] is not None and amount <= float(auction["highest_bid"]):
+        raise HTTPException(status_code=403, detail="Bid amount is too small")
+    if float(auction["base_price"]) > amount:
         raise HTTPException(status_code=403, detail="Bid amount is smaller than base price")
 
-    bid_id = uuid.uuid4()
+@app.post("/rest/auction/{id}/bid")
+async def bid_auction(id: str, bid: BidCreate):
+    # check if auction and user exist
+    # The auction itself is read from Cosmos: its ETag guards the update below
+    auction, user = await asyncio.gather(
+        read_auction(id),
+        read_model_or_404("users", users_container, bid.bidder_id, "USER", UserOutput, "User not found"),
+    )
+    amount = float(bid.amount)
+    materialized = None
+    if "bid_count" not in auction:
+        await materialize_highest_bid(auction)
+        materialized = {field: auction[field] for field in ("highest_bid", "highest_bidder_id", "bid_count")}
+    check_bid(auction, amount)
+
+    # The bid is stored before the auction accepts it, so the auction never
+    # points at a bid that doesn't exist; a bid the auction doesn't accept (rejected,
+    # or the replace failed or was cancelled) is deleted.
     new_bid = {
-        "id": str(bid_id),
+        "id": str(uuid.uuid4()),
+        "pk": auction["id"], # bids are stored next to the other bids of their auction
         "auction_id": auction["id"],
         "bidder_id": bid.bidder_id,
-        "amount": float(bid.amount)
+        "amount": amount
     }
-    bids_container.create_item(new_bid)
+    await bids_container.create_item(new_bid)
+
+    # The auction document carries the highest bid; a bid is accepted by an
+    # ETag-conditional replace, so two racing bids can't both win.
+    try:
+        for _ in range(BID_RETRIES):
+            etag = auction["_etag"]
+            auction["highest_bid"] = amount
+            auction["highest_bidder_id"] = bid.bidder_id
+            auction["highest_bid_id"] = new_bid["id"]
+            auction["bid_count"] += 1
+            try:
+                auction = await auctions_container.replace_item(
+                    item=auction["id"], body=auction,
+                    etag=etag, match_condition=MatchConditions.IfNotModified
+                )
+                break
+            except exceptions.CosmosAccessConditionFailedError:
+                # Someone else bid (or closed the auction) first; re-check against their state
+                auction = await auctions_container.read_item(item=auction["id"], partition_key=auction["pk"])
+                if "bid_count" not in auction:
+                    # Still no bid accepted on the auction itself: the bids container
+                    # now holds this bid as well, so keep what was found before storing it
+                    auction.update(materialized)
+                check_bid(auction, amount)
+        else:
+            raise HTTPException(status_code=409, detail="Too many concurrent bids, please retry")
+    except BaseException:
+        await bids_container.delete_item(item=new_bid["id"], partition_key=new_bid["pk"])
+        raise
+
+    if CACHING:
+        await entitycache.put("auctions", auction)
     return new_bid
 
+# Per-worker L1 cache counters, to size L1_CACHE_SIZE against the hit rate
+@app.get("/rest/cache/stats")
+async def get_cache_stats():
+    return localcache.snapshot()
+
+@app.get("/rest/query/stats")
+async def get_query_stats():
+    return queries.snapshot()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/rest/password-hashing/stats")
+async def get_password_hashing_stats():
+    return utils.snapshot()
 
 if __name__ == "__main__":
     import uvicorn
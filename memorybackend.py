@@ -0,0 +1,739 @@
+from azure.cosmos import exceptions
+from azure.cosmos.partition_key import NonePartitionKeyValue
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from dotenv import load_dotenv
+from shared_code.queries import REQUEST_CHARGE_HEADER
+from collections import OrderedDict
+import copy
+import datetime
+import orjson
+import os
+import re
+import time
+import uuid
+
+load_dotenv()
+
+# In-process stand-ins for Cosmos DB, Redis and Blob storage, selected with
+# STORAGE_BACKEND=memory. They implement the part of the Azure/redis client
+# APIs this codebase uses, so the same code paths run without any service,
+# e.g. for reproducible per-endpoint benchmarks (tests/bench_endpoints.py).
+# Nothing is persisted; every process starts empty.
+ENABLED = os.getenv("STORAGE_BACKEND", "azure").lower() == "memory"
+
+# Simulated request charges, in the ballpark of Cosmos DB's for small
+# documents with default indexing. Good for comparing code paths, not for
+# capacity planning.
+READ_RU_PER_KB = 1.0
+WRITE_RU_PER_KB = 5.0
+# Per physical partition a query visits; cross-partition queries visit all of them
+QUERY_BASE_RU = 2.3
+QUERY_RU_PER_KB = 1.0
+PHYSICAL_PARTITIONS = int(os.getenv("MEMORY_PHYSICAL_PARTITIONS", "1"))
+DEFAULT_PAGE_SIZE = 100
+# Parsed queries are kept by their text, like a query plan cache: a text that
+# differs for every value (formatted instead of parameterized) is parsed again
+# on each call and evicts the others
+PLAN_CACHE_SIZE = int(os.getenv("MEMORY_QUERY_PLAN_CACHE_SIZE", "256"))
+
+
+def _kb(doc) -> float:
+    return max(1.0, len(orjson.dumps(doc)) / 1024)
+
+
+class _Connection:
+    # The SDK exposes the headers of the last response here; so does this
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+class MemoryContainer:
+    """Partition-aware stand-in for azure.cosmos.aio.ContainerProxy (partition key path /pk)."""
+
+    def __init__(self, id: str, client_connection: _Connection):
+        self.id = id
+        self.client_connection = client_connection
+        self._partitions = {}  # pk -> {id: doc}
+        self._lsn = 0
+        self._versions = {}  # (pk, id) -> lsn of the latest write, for the change feed
+        self.stats = {"requests": 0, "request_charge": 0.0}
+
+    def _charge(self, request_charge: float, response_hook=None, result=None):
+        request_charge = round(request_charge, 2)
+        self.stats["requests"] += 1
+        self.stats["request_charge"] += request_charge
+        headers = {REQUEST_CHARGE_HEADER: str(request_charge), "x-ms-activity-id": str(uuid.uuid4())}
+        self.client_connection.last_response_headers = headers
+        if response_hook:
+            response_hook(headers, result)
+
+    def _write(self, doc: dict) -> dict:
+        doc = copy.deepcopy(doc)
+        doc["_etag"] = f'"{uuid.uuid4()}"'
+        doc["_ts"] = int(time.time())
+        self._lsn += 1
+        # Documents without a pk (legacy bids) are addressed with NonePartitionKeyValue
+        pk = doc.get("pk", NonePartitionKeyValue)
+        self._versions[pk, doc["id"]] = self._lsn
+        self._partitions.setdefault(pk, {})[doc["id"]] = doc
+        return copy.deepcopy(doc)
+
+    def _get(self, id: str, partition_key) -> dict:
+        doc = self._partitions.get(partition_key, {}).get(id)
+        if doc is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"{self.id}/{id} not found")
+        return doc
+
+    @staticmethod
+    def _check_etag(doc: dict, etag, match_condition):
+        if match_condition == MatchConditions.IfNotModified and doc["_etag"] != etag:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+
+    async def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        doc = copy.deepcopy(self._get(item, partition_key))
+        self._charge(READ_RU_PER_KB * _kb(doc), response_hook, doc)
+        return doc
+
+    async def create_item(self, body, response_hook=None, **kwargs):
+        if body["id"] in self._partitions.get(body.get("pk", NonePartitionKeyValue), {}):
+            raise exceptions.CosmosResourceExistsError(status_code=409, message=f"{self.id}/{body['id']} exists")
+        doc = self._write(body)
+        self._charge(WRITE_RU_PER_KB * _kb(doc), response_hook, doc)
+        return doc
+
+    async def upsert_item(self, body, response_hook=None, **kwargs):
+        doc = self._write(body)
+        self._charge(WRITE_RU_PER_KB * _kb(doc), response_hook, doc)
+        return doc
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, response_hook=None, **kwargs):
+        self._check_etag(self._get(item, body.get("pk", NonePartitionKeyValue)), etag, match_condition)
+        doc = self._write({**body, "id": item})
+        self._charge(WRITE_RU_PER_KB * _kb(doc), response_hook, doc)
+        return doc
+
+    async def patch_item(self, item, partition_key, patch_operations, etag=None, match_condition=None,
+                         response_hook=None, **kwargs):
+        doc = self._get(item, partition_key)
+        self._check_etag(doc, etag, match_condition)
+        doc = self._write(_patch(doc, patch_operations))
+        self._charge(WRITE_RU_PER_KB * _kb(doc), response_hook, doc)
+        return doc
+
+    async def delete_item(self, item, partition_key, response_hook=None, **kwargs):
+        doc = self._get(item, partition_key)
+        del self._partitions[partition_key][item]
+        self._versions.pop((partition_key, item), None)
+        self._charge(WRITE_RU_PER_KB * _kb(doc), response_hook)
+
+    async def execute_item_batch(self, batch_operations, partition_key, response_hook=None, **kwargs):
+        # All or nothing: the partition is restored from a copy if an operation fails
+        saved = (copy.deepcopy(self._partitions.get(partition_key, {})), self._lsn, dict(self._versions))
+        results, request_charge = [], 0.0
+        for index, operation in enumerate(batch_operations):
+            kind, args = operation[0], operation[1]
+            try:
+                if kind == "create":
+                    if args[0]["id"] in self._partitions.get(partition_key, {}):
+                        raise exceptions.CosmosResourceExistsError(status_code=409, message="exists")
+                    doc = self._write(args[0])
+                elif kind == "upsert":
+                    doc = self._write(args[0])
+                elif kind == "replace":
+                    self._get(args[0], partition_key)
+                    doc = self._write({**args[1], "id": args[0]})
+                elif kind == "patch":
+                    doc = self._write(_patch(self._get(args[0], partition_key), args[1]))
+                elif kind == "read":
+                    doc = copy.deepcopy(self._get(args[0], partition_key))
+                elif kind == "delete":
+                    doc = self._get(args[0], partition_key)
+                    del self._partitions[partition_key][args[0]]
+                    self._versions.pop((partition_key, args[0]), None)
+                    doc = None
+                else:
+                    raise ValueError(f"Unsupported batch operation: {kind}")
+            except exceptions.CosmosHttpResponseError as e:
+                self._partitions[partition_key], self._lsn, self._versions = saved
+                self._charge(request_charge, response_hook)
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=index, headers={}, status_code=e.status_code,
+                    message=f"Batch operation {index} failed: {e.message}", operation_responses=[]
+                )
+            operation_charge = round((READ_RU_PER_KB if kind == "read" else WRITE_RU_PER_KB) * _kb(doc or {}), 2)
+            request_charge += operation_charge
+            results.append({"statusCode": 200, "requestCharge": operation_charge, "resourceBody": doc})
+        self._charge(request_charge, response_hook, results)
+        return results
+
+    def query_items(self, query: str, parameters=None, partition_key=None, max_item_count=None,
+                    response_hook=None, **kwargs):
+        return _QueryIterable(self, query, parameters or [], partition_key, max_item_count, response_hook)
+
+    def query_items_change_feed(self, max_item_count=None, start_time=None, continuation=None,
+                                partition_key=None, **kwargs):
+        # Latest version of every item written after the start position, in write order
+        if continuation is not None:
+            start = int(continuation)
+        elif start_time == "Beginning":
+            start = 0
+        elif isinstance(start_time, datetime.datetime):
+            timestamp = start_time.timestamp()
+            start = min(
+                (lsn - 1 for (pk, id), lsn in self._versions.items() if self._partitions[pk][id]["_ts"] >= timestamp),
+                default=self._lsn
+            )
+        else:
+            start = self._lsn
+        return _ChangeFeedIterable(self, start, max_item_count or DEFAULT_PAGE_SIZE, partition_key)
+
+    def _documents(self, partition_key):
+        if partition_key is not None:
+            return list(self._partitions.get(partition_key, {}).values())
+        return [doc for partition in self._partitions.values() for doc in partition.values()]
+
+
+def _patch(doc: dict, operations: list) -> dict:
+    doc = copy.deepcopy(doc)
+    for operation in operations:
+        *parents, name = operation["path"].strip("/").split("/")
+        target = doc
+        for parent in parents:
+            target = target[parent]
+        if operation["op"] in ("set", "add", "replace"):
+            target[name] = operation["value"]
+        elif operation["op"] == "remove":
+            target.pop(name, None)
+        elif operation["op"] == "incr":
+            target[name] = target.get(name, 0) + operation["value"]
+        else:
+            raise ValueError(f"Unsupported patch operation: {operation['op']}")
+    return doc
+
+
+class _Page:
+    def __init__(self, items: list):
+        self._items = items
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self._items:
+            yield item
+
+
+class _QueryPages:
+    def __init__(self, iterable, continuation_token):
+        self._iterable = iterable
+        self.continuation_token = continuation_token
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        offset = 0
+        if self.continuation_token:
+            try:
+                offset = orjson.loads(self.continuation_token)["offset"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                raise exceptions.CosmosHttpResponseError(status_code=400, message="Invalid continuation token")
+        results, partitions = self._iterable.results()
+        page = results[offset:offset + self._iterable.page_size]
+        offset += len(page)
+        self.continuation_token = orjson.dumps({"offset": offset}).decode() if offset < len(results) else None
+        self._done = self.continuation_token is None
+        self._iterable.container._charge(
+            QUERY_BASE_RU * partitions + QUERY_RU_PER_KB * _kb(page), self._iterable.response_hook, page
+        )
+        return _Page(page)
+
+
+class _QueryIterable:
+    def __init__(self, container, query, parameters, partition_key, max_item_count, response_hook):
+        self.container = container
+        self.query = _parse(query)
+        self.parameters = {parameter["name"]: parameter["value"] for parameter in parameters}
+        self.partition_key = partition_key
+        self.page_size = max_item_count if max_item_count and max_item_count > 0 else DEFAULT_PAGE_SIZE
+        self.response_hook = response_hook
+        self._results = None
+
+    def results(self):
+        # Evaluated once per iterable, like a query snapshot; pages slice it
+        if self._results is None:
+            self._results = self.query.run(self.container._documents(self.partition_key), self.parameters)
+        return self._results, 1 if self.partition_key is not None else PHYSICAL_PARTITIONS
+
+    def by_page(self, continuation_token=None):
+        return _QueryPages(self, continuation_token)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        async for page in self.by_page():
+            async for item in page:
+                yield item
+
+
+class _ChangeFeedPages:
+    def __init__(self, container, start, page_size, partition_key):
+        self._container = container
+        self._position = start
+        self._page_size = page_size
+        self._partition_key = partition_key
+        self.continuation_token = str(start)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        versions = sorted(
+            (lsn, pk, id) for (pk, id), lsn in self._container._versions.items()
+            if lsn > self._position and (self._partition_key is None or pk == self._partition_key)
+        )[:self._page_size]
+        if not versions:
+            raise StopAsyncIteration
+        page = [copy.deepcopy(self._container._partitions[pk][id]) for _, pk, id in versions]
+        self._position = versions[-1][0]
+        self.continuation_token = str(self._position)
+        self._container._charge(QUERY_BASE_RU + QUERY_RU_PER_KB * _kb(page))
+        return _Page(page)
+
+
+class _ChangeFeedIterable:
+    def __init__(self, container, start, page_size, partition_key):
+        self._args = (container, start, page_size, partition_key)
+
+    def by_page(self, continuation_token=None):
+        container, start, page_size, partition_key = self._args
+        return _ChangeFeedPages(container, int(continuation_token) if continuation_token else start,
+                                page_size, partition_key)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        async for page in self.by_page():
+            async for item in page:
+                yield item
+
+
+class MemoryDatabase:
+    def __init__(self, id: str):
+        self.id = id
+        self.client_connection = _Connection()
+        self._containers = {}
+
+    def get_container_client(self, container) -> MemoryContainer:
+        if container not in self._containers:
+            self._containers[container] = MemoryContainer(container, self.client_connection)
+        return self._containers[container]
+
+    def create_container_if_not_exists(self, id, **kwargs) -> MemoryContainer:
+        return self.get_container_client(id)
+
+    def request_charge(self) -> float:
+        return sum(container.stats["request_charge"] for container in self._containers.values())
+
+
+_databases = {}
+
+
+def get_database(name: str) -> MemoryDatabase:
+    if name not in _databases:
+        _databases[name] = MemoryDatabase(name)
+    return _databases[name]
+
+
+# --- Cosmos SQL, the subset this codebase uses -------------------------------
+#   SELECT [TOP n] [VALUE] * | <expr>[, <expr>...] | COUNT(1) FROM c
+#   [WHERE <condition>] [ORDER BY c.<path> [ASC|DESC]] [OFFSET n LIMIT n]
+# Conditions: = != <> < <= > >=, AND, OR, NOT, parentheses, @parameters,
+# string/number/boolean/null literals, IS_DEFINED, ARRAY_CONTAINS,
+# CONTAINS, STARTSWITH, LOWER, UPPER. Missing properties are undefined, which
+# is neither true nor false, as in Cosmos DB.
+
+_UNDEFINED = object()
+_TOKEN = re.compile(r"\s*(?:(@\w+)|('(?:[^'\\]|\\.)*')|(\d+(?:\.\d+)?)|(\w+)|(!=|<>|<=|>=|[=<>(),.*\[\]]))")
+_FUNCTIONS = {
+    "IS_DEFINED": lambda value: value is not _UNDEFINED,
+    "ARRAY_CONTAINS": lambda array, value: isinstance(array, list) and value in array,
+    "CONTAINS": lambda text, part: isinstance(text, str) and isinstance(part, str) and part in text,
+    "STARTSWITH": lambda text, prefix: isinstance(text, str) and isinstance(prefix, str) and text.startswith(prefix),
+    "LOWER": lambda text: text.lower() if isinstance(text, str) else _UNDEFINED,
+    "UPPER": lambda text: text.upper() if isinstance(text, str) else _UNDEFINED,
+}
+
+
+def _tokenize(query: str) -> list:
+    tokens, position = [], 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if not match or match.end() == position:
+            raise exceptions.CosmosHttpResponseError(status_code=400, message=f"Syntax error at: {query[position:]}")
+        parameter, string, number, word, symbol = match.groups()
+        if parameter:
+            tokens.append(("param", parameter))
+        elif string:
+            tokens.append(("value", string[1:-1].replace("\\'", "'")))
+        elif number:
+            tokens.append(("value", float(number) if "." in number else int(number)))
+        elif word:
+            tokens.append(("word", word))
+        else:
+            tokens.append(("symbol", symbol))
+        position = match.end()
+    return tokens
+
+
+def _comparable(left, right) -> bool:
+    numbers = (int, float)
+    if isinstance(left, bool) or isinstance(right, bool):
+        return isinstance(left, bool) and isinstance(right, bool)
+    return (isinstance(left, numbers) and isinstance(right, numbers)) or type(left) is type(right)
+
+
+def _compare(operator: str, left, right):
+    if left is _UNDEFINED or right is _UNDEFINED:
+        return _UNDEFINED
+    if operator in ("=", "!=", "<>"):
+        equal = _comparable(left, right) and left == right
+        return equal if operator == "=" else not equal
+    if not _comparable(left, right) or left is None:
+        return _UNDEFINED
+    return {"<": left < right, "<=": left <= right, ">": left > right, ">=": left >= right}[operator]
+
+
+def _sort_key(value):
+    # Cosmos DB orders undefined < null < booleans < numbers < strings
+    if value is _UNDEFINED:
+        return (0, 0)
+    if value is None:
+        return (1, 0)
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    return (4, str(value))
+
+
+class _Parser:
+    def __init__(self, query: str):
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def keyword(self, *words) -> bool:
+        kind, value = self.peek()
+        if kind == "word" and value.upper() in words:
+            self.position += 1
+            return True
+        return False
+
+    def symbol(self, symbol: str) -> bool:
+        if self.peek() == ("symbol", symbol):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, check, what: str):
+        if not check:
+            raise exceptions.CosmosHttpResponseError(status_code=400, message=f"Expected {what} in query")
+
+    def number(self):
+        kind, value = self.peek()
+        self.position += 1
+        if kind == "param":
+            return lambda parameters: parameters[value]
+        self.expect(kind == "value" and isinstance(value, int), "a number")
+        return lambda parameters: value
+
+    # condition := and (OR and)*
+    def condition(self):
+        left = self.conjunction()
+        while self.keyword("OR"):
+            right = self.conjunction()
+            left = (lambda l, r: lambda doc, p: _or(l(doc, p), r(doc, p)))(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.keyword("AND"):
+            right = self.negation()
+            left = (lambda l, r: lambda doc, p: _and(l(doc, p), r(doc, p)))(left, right)
+        return left
+
+    def negation(self):
+        if self.keyword("NOT"):
+            inner = self.negation()
+            return lambda doc, p: _not(inner(doc, p))
+        return self.comparison()
+
+    def comparison(self):
+        left = self.operand()
+        kind, value = self.peek()
+        if kind == "symbol" and value in ("=", "!=", "<>", "<", "<=", ">", ">="):
+            self.position += 1
+            right = self.operand()
+            return lambda doc, p: _compare(value, left(doc, p), right(doc, p))
+        return left
+
+    def operand(self):
+        kind, value = self.peek()
+        if self.symbol("("):
+            inner = self.condition()
+            self.expect(self.symbol(")"), "')'")
+            return inner
+        self.position += 1
+        if kind == "value":
+            return lambda doc, p: value
+        if kind == "param":
+            return lambda doc, p: p.get(value, _UNDEFINED)
+        self.expect(kind == "word", "an expression")
+        upper = value.upper()
+        if upper in ("TRUE", "FALSE"):
+            return lambda doc, p: upper == "TRUE"
+        if upper == "NULL":
+            return lambda doc, p: None
+        if upper in _FUNCTIONS and self.symbol("("):
+            arguments = [self.condition()]
+            while self.symbol(","):
+                arguments.append(self.condition())
+            self.expect(self.symbol(")"), "')'")
+            function = _FUNCTIONS[upper]
+            return lambda doc, p: function(*(argument(doc, p) for argument in arguments))
+        self.expect(value == "c", "c.<property>")
+        path = []
+        while True:
+            if self.symbol("."):
+                path.append(self.peek()[1])
+                self.position += 1
+            elif self.symbol("["):
+                path.append(self.peek()[1])
+                self.position += 1
+                self.expect(self.symbol("]"), "']'")
+            else:
+                break
+        return lambda doc, p: _lookup(doc, path)
+
+    def select_item(self, index: int):
+        # (expression, output name); properties keep their name, anything else is $1, $2...
+        if self.keyword("COUNT"):
+            self.expect(self.symbol("("), "'('")
+            self.operand()
+            self.expect(self.symbol(")"), "')'")
+            return "COUNT", f"${index}"
+        expression = self.condition()
+        kind, name = self.tokens[self.position - 1]
+        return expression, name if kind == "word" else f"${index}"
+
+
+def _lookup(doc, path: list):
+    value = doc
+    for name in path:
+        if isinstance(value, dict) and name in value:
+            value = value[name]
+        elif isinstance(value, list) and isinstance(name, int) and name < len(value):
+            value = value[name]
+        else:
+            return _UNDEFINED
+    return value
+
+
+def _and(left, right):
+    if left is False or right is False:
+        return False
+    return True if left is True and right is True else _UNDEFINED
+
+
+def _or(left, right):
+    if left is True or right is True:
+        return True
+    return False if left is False and right is False else _UNDEFINED
+
+
+def _not(value):
+    return not value if isinstance(value, bool) else _UNDEFINED
+
+
+class _Query:
+    def __init__(self, query: str):
+        parser = _Parser(query)
+        parser.expect(parser.keyword("SELECT"), "SELECT")
+        self.top = parser.number() if parser.keyword("TOP") else None
+        self.value = parser.keyword("VALUE")
+        self.select = None
+        if not parser.symbol("*"):
+            self.select = [parser.select_item(1)]
+            while parser.symbol(","):
+                self.select.append(parser.select_item(len(self.select) + 1))
+        parser.expect(parser.keyword("FROM") and parser.keyword("C"), "FROM c")
+        self.where = parser.condition() if parser.keyword("WHERE") else None
+        self.order_by = None
+        if parser.keyword("ORDER"):
+            parser.expect(parser.keyword("BY"), "BY")
+            field = parser.operand()
+            descending = parser.keyword("DESC")
+            if not descending:
+                parser.keyword("ASC")
+            self.order_by = (field, descending)
+        self.offset = self.limit = None
+        if parser.keyword("OFFSET"):
+            self.offset = parser.number()
+            parser.expect(parser.keyword("LIMIT"), "LIMIT")
+            self.limit = parser.number()
+        parser.expect(parser.position == len(parser.tokens), "the end of the query")
+
+    def run(self, documents: list, parameters: dict) -> list:
+        if self.where is not None:
+            documents = [doc for doc in documents if self.where(doc, parameters) is True]
+        if self.order_by is not None:
+            field, descending = self.order_by
+            documents = sorted(documents, key=lambda doc: _sort_key(field(doc, parameters)), reverse=descending)
+        if self.offset is not None:
+            offset = self.offset(parameters)
+            documents = documents[offset:offset + self.limit(parameters)]
+        if self.top is not None:
+            documents = documents[:self.top(parameters)]
+
+        if self.select is None:
+            return copy.deepcopy(documents)
+        if self.select[0][0] == "COUNT":
+            count = len(documents)
+            return [count] if self.value else [{self.select[0][1]: count}]
+        if self.value:
+            expression = self.select[0][0]
+            values = (expression(doc, parameters) for doc in documents)
+            return [copy.deepcopy(value) for value in values if value is not _UNDEFINED]
+        results = []
+        for doc in documents:
+            row = {}
+            for expression, name in self.select:
+                value = expression(doc, parameters)
+                if value is not _UNDEFINED:
+                    row[name] = copy.deepcopy(value)
+            results.append(row)
+        return results
+
+
+_parsed = OrderedDict()
+plan_stats = {"hits": 0, "misses": 0}
+
+
+def _parse(query: str) -> _Query:
+    if query in _parsed:
+        plan_stats["hits"] += 1
+        _parsed.move_to_end(query)
+        return _parsed[query]
+    plan_stats["misses"] += 1
+    _parsed[query] = _Query(query)
+    while len(_parsed) > PLAN_CACHE_SIZE:
+        _parsed.popitem(last=False)
+    return _parsed[query]
+
+
+# --- Blob storage --------------------------------------------------------------
+
+class _BlobProperties:
+    def __init__(self, name: str, size: int, content_type: str):
+        self.name = name
+        self.size = size
+        self.content_settings = {"content_type": content_type}
+
+
+class _MemoryBlob:
+    def __init__(self, container, name: str):
+        self._container = container
+        self.blob_name = name
+
+    async def delete_blob(self, **kwargs):
+        if self._container._blobs.pop(self.blob_name, None) is None:
+            raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+
+
+class MemoryBlobContainer:
+    """Stand-in for azure.storage.blob.aio.ContainerClient."""
+
+    def __init__(self, name: str):
+        self.container_name = name
+        self.url = f"memory://blob/{name}"
+        self._blobs = {}  # name -> (data, content type)
+
+    async def upload_blob(self, name, data, length=None, content_type=None, overwrite=False, **kwargs):
+        if not overwrite and name in self._blobs:
+            raise ResourceExistsError(f"Blob {name} exists")
+        if hasattr(data, "read"):
+            data = data.read(length) if length is not None else data.read()
+        self._blobs[name] = (bytes(data), content_type)
+
+    def get_blob_client(self, blob) -> _MemoryBlob:
+        return _MemoryBlob(self, blob)
+
+    async def list_blobs(self, name_starts_with=None, **kwargs):
+        for name, (data, content_type) in sorted(self._blobs.items()):
+            if not name_starts_with or name.startswith(name_starts_with):
+                yield _BlobProperties(name, len(data), content_type)
+
+
+class MemoryBlobService:
+    """Stand-in for azure.storage.blob.aio.BlobServiceClient. No account key, so no SAS."""
+    credential = None
+
+    def __init__(self):
+        self._containers = {}
+
+    async def create_container(self, name, **kwargs):
+        if name in self._containers:
+            raise ResourceExistsError(f"Container {name} exists")
+        self._containers[name] = MemoryBlobContainer(name)
+
+    def get_container_client(self, container) -> MemoryBlobContainer:
+        if container not in self._containers:
+            self._containers[container] = MemoryBlobContainer(container)
+        return self._containers[container]
+
+    async def close(self):
+        pass
+
+
+_blob_service = None
+
+
+def blob_service() -> MemoryBlobService:
+    global _blob_service
+    if _blob_service is None:
+        _blob_service = MemoryBlobService()
+    return _blob_service
+
+
+# --- Redis ---------------------------------------------------------------------
+
+def redis_clients():
+    """
+    (sync, async, async bytes) clients of one in-process Redis. fakeredis
+    rather than a plain dict, as the caches run Lua scripts, pub/sub and
+    sorted-set commands that have to behave like Redis's.
+    """
+    try:
+        import fakeredis
+    except ImportError as e:
+        raise RuntimeError(
+            "STORAGE_BACKEND=memory needs fakeredis: pip install -r requirements-dev.txt"
+        ) from e
+
+    server = fakeredis.FakeServer()
+    return (
+        fakeredis.FakeRedis(server=server, decode_responses=True),
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=False),
+    )
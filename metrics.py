@@ -0,0 +1,291 @@
+from azure.core.async_paging import AsyncItemPaged
+from azure.cosmos import exceptions
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from shared_code.queries import REQUEST_CHARGE_HEADER
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Per-request instrumentation. MetricsMiddleware starts a record for every
+# request; the Cosmos container proxy, the Redis connections and the blob
+# manager add their calls to it, and entitycache its cache lookups. When the
+# response is sent the record is observed into the histograms served on
+# GET /metrics (per worker process, like the other stats endpoints).
+# Requests slower than SLOW_REQUEST_SECONDS are logged with their queries.
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1"))
+# Queries listed in one slow-request log line
+SLOW_LOG_QUERIES = 20
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+DEPENDENCIES = ("cosmos", "redis", "blob")
+
+# Operations of a container client that make one request to Cosmos DB
+_COSMOS_OPERATIONS = {
+    "read_item", "create_item", "upsert_item", "replace_item", "patch_item", "delete_item", "execute_item_batch"
+}
+
+REQUEST_SECONDS = Histogram(
+    "lego_request_duration_seconds", "Request latency", ["method", "route", "status"]
+)
+REQUEST_CHARGE = Histogram(
+    "lego_request_cosmos_request_units", "Cosmos DB request units consumed by a request", ["method", "route"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+DEPENDENCY_CALLS = Histogram(
+    "lego_request_dependency_calls", "Calls a request made to Cosmos DB, Redis or blob storage",
+    ["method", "route", "dependency"], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100)
+)
+DEPENDENCY_SECONDS = Histogram(
+    "lego_request_dependency_seconds", "Time a request spent in calls to Cosmos DB, Redis or blob storage",
+    ["method", "route", "dependency"]
+)
+CACHE_LOOKUPS = Counter(
+    "lego_cache_lookups", "Cache lookups by tier (l1, redis) and key family", ["route", "tier", "family", "result"]
+)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.calls = dict.fromkeys(DEPENDENCIES, 0)
+        # Summed over calls, so concurrent calls can add up to more than the request took
+        self.seconds = dict.fromkeys(DEPENDENCIES, 0.0)
+        self.request_charge = 0.0
+        self.queries = []
+        # (tier, family, result) -> lookups
+        self.cache = {}
+
+    def add(self, dependency: str, seconds: float, calls: int = 1, request_charge: float = 0.0):
+        self.calls[dependency] += calls
+        self.seconds[dependency] += seconds
+        self.request_charge += request_charge
+
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def record(dependency: str, seconds: float, calls: int = 1, request_charge: float = 0.0):
+    """Add calls to the current request's record; outside of a request this does nothing."""
+    current = _current.get()
+    if current is not None:
+        current.add(dependency, seconds, calls, request_charge)
+
+
+@contextlib.contextmanager
+def timed(dependency: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(dependency, time.perf_counter() - start)
+
+
+def cache_lookup(tier: str, family: str, result: str):
+    """Count a lookup ("hit", "miss" or "stale") of a key family, e.g. "user" for user:{id}."""
+    current = _current.get()
+    if current is not None:
+        key = (tier, family, result)
+        current.cache[key] = current.cache.get(key, 0) + 1
+
+
+def _request_charge(headers) -> float:
+    try:
+        return float((headers or {}).get(REQUEST_CHARGE_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Query:
+    def __init__(self, current: RequestMetrics, text: str, response_hook=None):
+        self.current = current
+        self.text = text
+        self.response_hook = response_hook
+        self.pages = 0
+        self.seconds = 0.0
+        self.request_charge = 0.0
+
+    def on_response(self, headers, result):
+        if self.response_hook:
+            self.response_hook(headers, result)
+        # The SDK also calls the hook once up front, with the pager and the
+        # headers of the container's previous response
+        if isinstance(result, AsyncItemPaged):
+            return
+        request_charge = _request_charge(headers)
+        self.pages += 1
+        self.request_charge += request_charge
+        self.current.add("cosmos", 0.0, request_charge=request_charge)
+
+    def add_time(self, seconds: float):
+        self.seconds += seconds
+        self.current.add("cosmos", seconds, calls=0)
+
+
+class _TimedIterator:
+    # Pages are fetched while iterating, so that is where query time is spent
+    def __init__(self, iterator, query: _Query):
+        self._iterator = iterator
+        self._query = query
+
+    def __getattr__(self, name):
+        # e.g. continuation_token of by_page()
+        return getattr(self._iterator, name)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        start = time.perf_counter()
+        try:
+            return await self._iterator.__anext__()
+        finally:
+            self._query.add_time(time.perf_counter() - start)
+
+
+class _TimedQuery:
+    def __init__(self, iterable, query: _Query):
+        self._iterable = iterable
+        self._query = query
+
+    def __aiter__(self):
+        return _TimedIterator(self._iterable.__aiter__(), self._query)
+
+    def by_page(self, *args, **kwargs):
+        return _TimedIterator(self._iterable.by_page(*args, **kwargs), self._query)
+
+
+class CosmosContainer:
+    """
+    A Cosmos DB container client that records the time and request charge of
+    its calls in the current request's metrics; anything else is passed through.
+    """
+    def __init__(self, container):
+        self._container = container
+
+    def __getattr__(self, name):
+        if name in _COSMOS_OPERATIONS:
+            return functools.partial(self._call, name)
+        return getattr(self._container, name)
+
+    async def _call(self, operation: str, *args, **kwargs):
+        current = _current.get()
+        if current is None:
+            return await getattr(self._container, operation)(*args, **kwargs)
+
+        charges = []
+        response_hook = kwargs.pop("response_hook", None)
+
+        def on_response(headers, result):
+            if response_hook:
+                response_hook(headers, result)
+            charges.append(_request_charge(headers))
+
+        start = time.perf_counter()
+        try:
+            return await getattr(self._container, operation)(*args, response_hook=on_response, **kwargs)
+        except exceptions.CosmosHttpResponseError as e:
+            # Failed requests (404, 412, ...) are charged as well
+            charges.append(_request_charge(e.headers))
+            raise
+        finally:
+            current.add("cosmos", time.perf_counter() - start, request_charge=sum(charges))
+
+    def query_items(self, query: str, **kwargs):
+        current = _current.get()
+        if current is None:
+            return self._container.query_items(query=query, **kwargs)
+        entry = _Query(current, query, kwargs.pop("response_hook", None))
+        current.queries.append(entry)
+        return _TimedQuery(self._container.query_items(query=query, response_hook=entry.on_response, **kwargs), entry)
+
+
+class _TimedRedisConnection:
+    # Every command or pipeline sent is one call; waiting for the replies counts towards its time
+    async def send_packed_command(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().send_packed_command(*args, **kwargs)
+        finally:
+            record("redis", time.perf_counter() - start)
+
+    async def read_response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().read_response(*args, **kwargs)
+        finally:
+            record("redis", time.perf_counter() - start, calls=0)
+
+
+def instrument_redis(client):
+    """Record the calls made through an async Redis client's connections (opened lazily by its pool)."""
+    pool = client.connection_pool
+    pool.connection_class = type(pool.connection_class.__name__, (_TimedRedisConnection, pool.connection_class), {})
+    return client
+
+
+def _log_slow_request(method: str, route: str, status: int, seconds: float, current: RequestMetrics):
+    lines = [
+        f"Slow request {method} {route} ({status}) took {seconds:.3f}s, "
+        f"{current.request_charge:.1f} RU; "
+        + ", ".join(
+            f"{dependency} {current.calls[dependency]} calls {current.seconds[dependency]:.3f}s"
+            for dependency in DEPENDENCIES
+        )
+    ]
+    queries = sorted(current.queries, key=lambda query: query.seconds, reverse=True)
+    for query in queries[:SLOW_LOG_QUERIES]:
+        lines.append(f"  {query.seconds:.3f}s {query.request_charge:.1f} RU {query.pages} pages: {query.text}")
+    if len(queries) > SLOW_LOG_QUERIES:
+        lines.append(f"  ... {len(queries) - SLOW_LOG_QUERIES} more queries")
+    logger.warning("\n".join(lines))
+
+
+def _observe(method: str, route: str, status: int, seconds: float, current: RequestMetrics):
+    REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+    REQUEST_CHARGE.labels(method, route).observe(current.request_charge)
+    for dependency in DEPENDENCIES:
+        DEPENDENCY_CALLS.labels(method, route, dependency).observe(current.calls[dependency])
+        DEPENDENCY_SECONDS.labels(method, route, dependency).observe(current.seconds[dependency])
+    for (tier, family, result), lookups in current.cache.items():
+        CACHE_LOOKUPS.labels(route, tier, family, result).inc(lookups)
+    if seconds >= SLOW_REQUEST_SECONDS:
+        _log_slow_request(method, route, status, seconds, current)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records every HTTP request, including streamed response bodies."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            _current.reset(token)
+            # Route templates, not paths, so ids don't end up in label values
+            route = scope.get("route")
+            _observe(scope["method"], getattr(route, "path", "unmatched"), status,
+                     time.perf_counter() - start, current)
+
+
+def render() -> bytes:
+    return generate_latest()
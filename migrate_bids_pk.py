@@ -0,0 +1,32 @@
+# One-off migration: every bid is stored with pk = auction_id, so the bids of
+# an auction live in one partition. Bids written by older versions of the API
+# have no pk at all. A partition key can't be changed in place, so affected
+# bids are re-created under the right key and the old copy is deleted.
+from azure.cosmos.partition_key import NonePartitionKeyValue
+from cosmosdb import database
+
+bids_container = database.get_container_client("bids")
+
+SYSTEM_FIELDS = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+
+def migrate_bids():
+    bids = list(bids_container.query_items(
+        query="SELECT * FROM c WHERE NOT IS_DEFINED(c.pk) OR c.pk != c.auction_id",
+        enable_cross_partition_query=True
+    ))
+    print(f"Found {len(bids)} bids to migrate")
+
+    for bid in bids:
+        old_pk = bid.get("pk", NonePartitionKeyValue)
+        body = {k: v for k, v in bid.items() if k not in SYSTEM_FIELDS}
+        body["pk"] = bid["auction_id"]
+        # Same id in another partition is allowed, so write first, then delete
+        bids_container.upsert_item(body=body)
+        bids_container.delete_item(item=bid["id"], partition_key=old_pk)
+
+    print("Bid migration completed!")
+
+
+if __name__ == "__main__":
+    migrate_bids()
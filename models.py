@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import datetime
 
 class UserCreate(BaseModel):
@@ -25,6 +25,8 @@ class UserOutput(BaseModel):
 class MediaOutput(BaseModel):
     blob_name: str
     url: str
+    # Rendition name ("original", "medium", "thumbnail") -> url
+    renditions: Optional[Dict[str, str]] = None
 
 
 class LegoSetUpdate(BaseModel):
@@ -32,6 +34,7 @@ class LegoSetUpdate(BaseModel):
     code_number: Optional[str] = None
     description: Optional[str] = None
     photo_blob_names: Optional[List[str]] = None
+    photo_renditions: Optional[List[Dict[str, str]]] = None
     owner_id: Optional[str] = None
 
 
@@ -42,6 +45,15 @@ class LegoSetOutput(BaseModel):
     description: Optional[str] = None
     photo_blob_names: List[str]
     owner_id: Optional[str] = None
+    # One {rendition: blob name} per photo, see renditions.py
+    photo_renditions: Optional[List[Dict[str, str]]] = None
+    # Only filled in with ?include_urls=true
+    photo_urls: Optional[List[str]] = None
+
+
+class LegoSetMediaOutput(BaseModel):
+    legoset_id: str
+    media: List[MediaOutput]
 
 
 class CommentCreate(BaseModel):
@@ -78,6 +90,9 @@ class AuctionOut(BaseModel):
     winning_bid: Optional[float] = None
     closed_at: Optional[str] = None
     created_at: Optional[str] = None
+    highest_bid: Optional[float] = None
+    highest_bidder_id: Optional[str] = None
+    bid_count: Optional[int] = None
 
 class BidCreate(BaseModel):
     auction_id: str
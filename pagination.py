@@ -0,0 +1,118 @@
+from azure.cosmos import exceptions
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+from typing import Annotated, Optional
+import base64
+import binascii
+import orjson
+import os
+from shared_code import queries
+import time
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# `limit` of the list endpoints; values outside 1..MAX_PAGE_SIZE are rejected with a 422
+Limit = Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)]
+
+
+def is_paged(limit: Optional[int], cursor: Optional[str], fields: Optional[str]) -> bool:
+    # Without any of these the list endpoints keep returning the full (cached) list
+    return limit is not None or cursor is not None or fields is not None
+
+
+def encode_cursor(continuation_token: Optional[str]) -> Optional[str]:
+    # Cosmos continuation tokens are JSON; make them safe to pass in a query string
+    if not continuation_token:
+        return None
+    return base64.urlsafe_b64encode(continuation_token.encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def projection(model, fields: Optional[str]):
+    """
+    SELECT list for `fields` (comma separated names of `model`), so unneeded
+    properties never leave Cosmos. Returns ("*", None) when all fields are wanted.
+    """
+    if not fields:
+        return "*", None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    selected = list(dict.fromkeys(["id"] + requested))
+    # Names are checked against the model above, so they are safe to inline
+    return ", ".join(f"c.{field}" for field in selected), selected
+
+
+class Page(BaseModel):
+    items: list
+    next_cursor: Optional[str] = None
+
+
+async def query_page(container, model, query: queries.Query, limit: Optional[int], cursor: Optional[str],
+                     fields: Optional[str], parameters: dict = None, **kwargs) -> Page:
+    """
+    One page of a named query (with a `{select}` placeholder for the
+    projection), resumed from `cursor`. `next_cursor` is None on the last page.
+    """
+    select, selected = projection(model, fields)
+    page_size = DEFAULT_PAGE_SIZE if limit is None else limit
+
+    charge = queries.Charge()
+    pages = container.query_items(
+        **query.bind(parameters, select),
+        max_item_count=page_size,
+        response_hook=charge,
+        **kwargs
+    ).by_page(decode_cursor(cursor))
+
+    items = []
+    start = time.perf_counter()
+    try:
+        async for page in pages:
+            items = [item async for item in page]
+            break
+    except exceptions.CosmosHttpResponseError as e:
+        if cursor and e.status_code == 400:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        raise
+    finally:
+        queries.record(query.name, time.perf_counter() - start, charge.total, len(items))
+
+    if selected is None:
+        items = [model(**item).model_dump() for item in items]
+    else:
+        items = [{field: item.get(field) for field in selected} for item in items]
+
+    return Page(items=items, next_cursor=encode_cursor(pages.continuation_token))
+
+
+async def export_ndjson(container, model, cursor: Optional[str] = None, checkpoints: bool = False):
+    """
+    Stream a whole container as newline-delimited JSON, one Cosmos page at a
+    time, so memory stays bounded by EXPORT_PAGE_SIZE regardless of size.
+    With `checkpoints`, a {"next_cursor": ...} line follows every page; pass
+    the last one back as `cursor` to resume an interrupted export.
+    """
+    # Project the output model's fields in SQL instead of validating every row
+    select, _ = projection(model, ",".join(model.model_fields))
+    pages = container.query_items(
+        **queries.PAGE.bind(select=select),
+        max_item_count=EXPORT_PAGE_SIZE
+    ).by_page(decode_cursor(cursor))
+
+    async for page in pages:
+        lines = [orjson.dumps(item) + b"\n" async for item in page]
+        if checkpoints:
+            lines.append(orjson.dumps({"next_cursor": encode_cursor(pages.continuation_token)}) + b"\n")
+        yield b"".join(lines)
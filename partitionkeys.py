@@ -0,0 +1,35 @@
+from rediscache import async_redis_client as r
+import logging
+import metrics
+from shared_code import queries
+
+logger = logging.getLogger(__name__)
+
+# Collections whose partition key can't be derived from the id alone.
+# Auctions are partitioned by legoset_id but addressed by id in the API.
+# Fixed or derivable keys: users -> "USER", legosets -> "LEGOSET",
+# comments -> legoset_id, bids -> auction_id.
+
+
+def _hash_key(collection: str) -> str:
+    return f"pk:{collection}"
+
+
+async def remember(collection: str, id: str, pk: str):
+    await r.hset(_hash_key(collection), id, pk)
+
+
+async def resolve(collection: str, id: str, container):
+    """Partition key of an item, so callers can use read_item instead of a cross-partition scan."""
+    pk = await r.hget(_hash_key(collection), id)
+    metrics.cache_lookup("redis", _hash_key(collection), "miss" if pk is None else "hit")
+    if pk is not None:
+        return pk
+
+    # Unknown id (created before this index, or by another writer): one
+    # cross-partition lookup, then it is a point read from here on
+    results = await queries.fetch(container, queries.PARTITION_KEY, {"id": id})
+    if not results:
+        return None
+    await remember(collection, id, results[0])
+    return results[0]
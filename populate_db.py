@@ -3,15 +3,27 @@ import uuid
 import os
 import random
 import datetime
+import cosmosdb
 from cosmosdb import database
 from blobstorage import BlobStorageManager
+from fastapi import UploadFile
+from starlette.datastructures import Headers
 from models import UserCreate, LegoSetUpdate, CommentCreate, AuctionCreate, BidCreate
+import argparse
 import asyncio
+import time
 from typing import List
 import json
+import renditions
+import sentiment
 
 fake = Faker()
 
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "tests", "images")
+AVAILABLE_IMAGES = sorted(f for f in os.listdir(IMAGES_DIR) if f.endswith('.jpg'))
+# Blob prefix of the images shared by all bulk-generated lego sets
+SHARED_IMAGES_PREFIX = "populate"
+
 # Initialize containers
 users_container = database.get_container_client("users")
 legosets_container = database.get_container_client("legosets")
@@ -19,9 +31,6 @@ comments_container = database.get_container_client("comments")
 auctions_container = database.get_container_client("auctions")
 bids_container = database.get_container_client("bids")
 
-# Initialize blob storage
-blob_manager = BlobStorageManager()
-
 # Load comment templates
 COMMENT_TEMPLATES = [
     # Positive comments
@@ -50,13 +59,18 @@ COMMENT_TEMPLATES = [
 ]
 
 
-def create_user() -> dict:
+def new_id() -> str:
+    # Drawn from `random`, so a seeded run generates the same ids
+    return str(uuid.UUID(int=random.getrandbits(128), version=4))
+
+
+def new_user() -> dict:
     first_name = fake.first_name()
     last_name = fake.last_name()
     nickname = f"{first_name}.{last_name}"
     
-    user_id = str(uuid.uuid4())
-    user = {
+    user_id = new_id()
+    return {
         "id": user_id,
         "pk": "USER",
         "nickname": nickname,
@@ -66,74 +80,97 @@ def create_user() -> dict:
         "owned_sets": [],
         "created_at": datetime.datetime.now().isoformat()
     }
-    
-    return users_container.create_item(body=user)
 
-def create_legoset(owner_id: str = None) -> dict:
-    # Get random images for this lego set (1-3 images)
-    image_count = random.randint(1, 3)
-    base_path = os.path.join(os.path.dirname(__file__), "test", "images")
-    available_images = [f for f in os.listdir(base_path) if f.endswith('.jpg')]
-    selected_images = random.sample(available_images, image_count)
-    image_paths = [os.path.join(base_path, img) for img in selected_images]
-    
-    # Upload images to blob storage
-    legoset_id = str(uuid.uuid4())
-    blob_names = blob_manager.upload_legoset_images(image_paths, legoset_id)
-    
-    # Create lego set
-    legoset = {
-        "id": legoset_id,
+
+def create_user() -> dict:
+    return users_container.create_item(body=new_user())
+
+async def upload_images(image_names: List[str], legoset_id: str) -> List[dict]:
+    files = []
+    for name in image_names:
+        path = os.path.join(IMAGES_DIR, name)
+        files.append(UploadFile(
+            file=open(path, "rb"),
+            size=os.path.getsize(path),
+            filename=name,
+            headers=Headers({"content-type": "image/jpeg"}),
+        ))
+    try:
+        async with BlobStorageManager() as blob_manager:
+            uploaded, _ = await blob_manager.upload_legoset_images(files, legoset_id)
+            return uploaded
+    finally:
+        for file in files:
+            file.file.close()
+
+def new_legoset(photos: List[dict], owner_id: str = None, legoset_id: str = None) -> dict:
+    return {
+        "id": legoset_id or new_id(),
         "pk": "LEGOSET",
         "name": fake.catch_phrase(),
         "code_number": f"{random.randint(1000, 9999)}-{random.randint(1, 9)}",
         "description": fake.text(max_nb_chars=200),
-        "photo_blob_names": blob_names,
+        "photo_blob_names": [photo["original"] for photo in photos],
+        "photo_renditions": photos,
         "owner_id": owner_id,
         "created_at": datetime.datetime.now().isoformat()
     }
-    
-    return legosets_container.create_item(body=legoset)
 
-def create_comment(user_id: str, legoset_id: str, legoset_name: str) -> dict:
+def create_legoset(owner_id: str = None) -> dict:
+    # Get random images for this lego set (1-3 images)
+    image_count = random.randint(1, 3)
+    selected_images = random.sample(AVAILABLE_IMAGES, image_count)
+
+    # Upload images to blob storage
+    legoset_id = new_id()
+    photos = asyncio.run(upload_images(selected_images, legoset_id))
+    return legosets_container.create_item(body=new_legoset(photos, owner_id, legoset_id))
+
+def new_comment(user_id: str, legoset_id: str, legoset_name: str) -> dict:
     template = random.choice(COMMENT_TEMPLATES)
-    comment = {
-        "id": str(uuid.uuid4()),
+    return {
+        "id": new_id(),
         "pk": legoset_id,
         "user_id": user_id,
         "legoset_id": legoset_id,
         "text": template.format(product=legoset_name),
         "created_at": datetime.datetime.now().isoformat()
     }
-    
-    return comments_container.create_item(body=comment)
 
-def create_auction(legoset_id: str, seller_id: str) -> dict:
+def create_comment(user_id: str, legoset_id: str, legoset_name: str) -> dict:
+    return comments_container.create_item(body=new_comment(user_id, legoset_id, legoset_name))
+
+def new_auction(legoset_id: str, seller_id: str) -> dict:
     close_date = datetime.datetime.now() + datetime.timedelta(days=random.randint(1, 30))
-    auction = {
-        "id": str(uuid.uuid4()),
+    return {
+        "id": new_id(),
         "pk": legoset_id,
         "legoset_id": legoset_id,
         "seller_id": seller_id,
         "base_price": round(random.uniform(10.0, 500.0), 2),
         "close_date": close_date.isoformat(),
         "status": "open",
+        "highest_bid": None,
+        "highest_bidder_id": None,
+        "bid_count": 0,
         "created_at": datetime.datetime.now().isoformat()
     }
-    
-    return auctions_container.create_item(body=auction)
 
-def create_bid(auction_id: str, bidder_id: str, current_price: float) -> dict:
-    bid = {
-        "id": str(uuid.uuid4()),
+def create_auction(legoset_id: str, seller_id: str) -> dict:
+    return auctions_container.create_item(body=new_auction(legoset_id, seller_id))
+
+def new_bid(auction_id: str, bidder_id: str, current_price: float) -> dict:
+    return {
+        "id": new_id(),
         "pk": auction_id,
         "auction_id": auction_id,
         "bidder_id": bidder_id,
         "amount": round(current_price + random.uniform(1.0, 50.0), 2),
         "created_at": datetime.datetime.now().isoformat()
     }
-    
-    return bids_container.create_item(body=bid)
+
+def create_bid(auction_id: str, bidder_id: str, current_price: float) -> dict:
+    return bids_container.create_item(body=new_bid(auction_id, bidder_id, current_price))
 
 def populate_database():
     print("Creating users...")
@@ -190,9 +227,140 @@ def populate_database():
                 )
                 current_price = bid["amount"]
                 bids_count += 1
+                auction["highest_bid"] = bid["amount"]
+                auction["highest_bidder_id"] = bid["bidder_id"]
+                auction["highest_bid_id"] = bid["id"]
+            auction["bid_count"] = bid_count
+            auctions_container.replace_item(item=auction["id"], body=auction)
 
     print(f"Created {auctions_count} auctions and {bids_count} bids")
     print("\nDatabase population completed!")
 
+
+# Bulk mode: the whole dataset is generated in memory first, so owned_sets and
+# the auctions' highest bids are final and every document is written once,
+# then upserted through the async client with bounded concurrency.
+
+async def shared_photos(count: int) -> List[dict]:
+    """`count` sample images as upload_photo() results, uploaded only if an earlier run hasn't."""
+    photos = {}
+    async with BlobStorageManager() as blob_manager:
+        async for blob in blob_manager.container_client.list_blobs(name_starts_with=f"{SHARED_IMAGES_PREFIX}/"):
+            base, _ = os.path.splitext(blob.name)
+            for size in renditions.SIZES:
+                if base.endswith(f"_{size}"):
+                    photos.setdefault(base[:-len(size) - 1], {})[size] = blob.name
+                    break
+            else:
+                photos.setdefault(base, {})["original"] = blob.name
+    photos = [photo for photo in photos.values() if "original" in photo]
+
+    count = min(count, len(AVAILABLE_IMAGES))
+    if len(photos) < count:
+        photos += await upload_images(AVAILABLE_IMAGES[len(photos):count], SHARED_IMAGES_PREFIX)
+    # Sorted, so a seeded run picks the same photos whether they were just uploaded or not
+    return sorted(photos, key=lambda photo: photo["original"])[:count]
+
+
+def generate_dataset(users_count: int, legosets_count: int, comments_count: int, auctions_count: int,
+                     max_bids: int, photos: List[dict]) -> dict:
+    users = [new_user() for _ in range(users_count)]
+
+    legosets = []
+    for _ in range(legosets_count):
+        # 70% chance of having an owner
+        owner = random.choice(users) if users and random.random() < 0.7 else None
+        legoset_photos = random.sample(photos, min(len(photos), random.randint(1, 3)))
+        legoset = new_legoset(legoset_photos, owner["id"] if owner else None)
+        legosets.append(legoset)
+        if owner:
+            owner["owned_sets"].append(legoset["id"])
+
+    comments = [
+        new_comment(random.choice(users)["id"], legoset["id"], legoset["name"])
+        for legoset in random.choices(legosets, k=comments_count if legosets and users else 0)
+    ]
+    # Scored in one batch here, as POST /rest/legoset/{id}/comment does on write
+    for comment, polarity in zip(comments, sentiment.polarities([comment["text"] for comment in comments])):
+        comment["polarity"] = float(polarity)
+
+    auctions, bids = [], []
+    for legoset in random.sample(legosets, min(auctions_count, len(legosets)) if users else 0):
+        auction = new_auction(legoset["id"], legoset.get("owner_id") or random.choice(users)["id"])
+        current_price = auction["base_price"]
+        for _ in range(random.randint(0, max_bids)):
+            bid = new_bid(auction["id"], random.choice(users)["id"], current_price)
+            bids.append(bid)
+            current_price = bid["amount"]
+            auction["highest_bid"] = bid["amount"]
+            auction["highest_bidder_id"] = bid["bidder_id"]
+            auction["highest_bid_id"] = bid["id"]
+            auction["bid_count"] += 1
+        auctions.append(auction)
+
+    return {"users": users, "legosets": legosets, "comments": comments, "auctions": auctions, "bids": bids}
+
+
+async def upsert_all(container, docs: List[dict], concurrency: int):
+    pending = iter(docs)
+
+    async def worker():
+        # The workers share one iterator, so at most `concurrency` writes are in flight
+        for doc in pending:
+            await container.upsert_item(body=doc)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def populate_bulk(users: int, legosets: int, comments: int, auctions: int, max_bids: int,
+                        images: int, concurrency: int):
+    photos = await shared_photos(images) if images else []
+    print(f"Using {len(photos)} shared images")
+
+    start = time.perf_counter()
+    dataset = generate_dataset(users, legosets, comments, auctions, max_bids, photos)
+    total = sum(len(docs) for docs in dataset.values())
+    print(f"Generated {total} documents in {time.perf_counter() - start:.1f}s")
+
+    async_database = await cosmosdb.init_async_database()
+    if async_database is None:
+        raise SystemExit("Cosmos DB is not configured")
+    try:
+        start = time.perf_counter()
+        for name, docs in dataset.items():
+            container_start = time.perf_counter()
+            await upsert_all(async_database.get_container_client(name), docs, concurrency)
+            elapsed = time.perf_counter() - container_start
+            print(f"Wrote {len(docs)} {name} in {elapsed:.1f}s ({len(docs) / max(elapsed, 1e-9):,.0f}/s)")
+    finally:
+        await cosmosdb.close_async_database()
+    print(f"\nWrote {total} documents in {time.perf_counter() - start:.1f}s")
+    print("Run `python sentimentindex.py` to rebuild the most-liked index")
+
+
 if __name__ == "__main__":
-    populate_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fill the database with generated test data")
+    parser.add_argument("--bulk", action="store_true",
+                        help="generate the dataset in memory and upsert it concurrently (the options below apply to it)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--legosets", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=1250, help="total, spread randomly over the lego sets")
+    parser.add_argument("--auctions", type=int, default=150, help="at most one per lego set")
+    parser.add_argument("--max-bids", type=int, default=10, help="per auction")
+    parser.add_argument("--images", type=int, default=len(AVAILABLE_IMAGES),
+                        help="sample images uploaded once and shared by all lego sets (0 for none)")
+    parser.add_argument("--concurrency", type=int, default=50, help="upserts in flight")
+    parser.add_argument("--seed", type=int, help="makes the generated data reproducible")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        Faker.seed(args.seed)
+    try:
+        if args.bulk:
+            asyncio.run(populate_bulk(args.users, args.legosets, args.comments, args.auctions, args.max_bids,
+                                      args.images, args.concurrency))
+        else:
+            populate_database()
+    finally:
+        renditions.shutdown()
\ No newline at end of file
@@ -1,6 +1,9 @@
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 import os
+import memorybackend
+import metrics
 
 load_dotenv()
 
@@ -10,38 +13,53 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
 r = None
 
-try:
-    # If a password is provided, assume a managed/secure Redis instance.
-    if REDIS_KEY:
-        r = redis.Redis(
-            host=REDIS_ENDPOINT,
-            port=REDIS_PORT,
-            password=REDIS_KEY,
-            ssl=True,
-            decode_responses=True,
-            socket_timeout=10,
-            socket_connect_timeout=10
-        )
-    else:
-        # Fallback to in-cluster Redis without auth (for local/k8s testing)
-        r = redis.Redis(
-            host=REDIS_ENDPOINT,
-            port=REDIS_PORT,
-            decode_responses=True,
-            socket_timeout=10,
-            socket_connect_timeout=10
-        )
-
-    # Test the connection
-    r.ping()
-    print("Successfully connected to Redis at", REDIS_ENDPOINT)
-
-except redis.AuthenticationError:
-    print("Authentication failed. Check your Redis key.")
-    raise
-except Exception as e:
-    print(f"Connection failed: {e}")
-    raise
+# If a password is provided, assume a managed/secure Redis instance.
+# Otherwise fall back to in-cluster Redis without auth (for local/k8s testing)
+if REDIS_KEY:
+    connection_options = dict(
+        host=REDIS_ENDPOINT,
+        port=REDIS_PORT,
+        password=REDIS_KEY,
+        ssl=True,
+        decode_responses=True,
+        socket_timeout=10,
+        socket_connect_timeout=10
+    )
+else:
+    connection_options = dict(
+        host=REDIS_ENDPOINT,
+        port=REDIS_PORT,
+        decode_responses=True,
+        socket_timeout=10,
+        socket_connect_timeout=10
+    )
+
+if memorybackend.ENABLED:
+    # In-process Redis (STORAGE_BACKEND=memory, see memorybackend.py)
+    r, async_redis_client, async_redis_raw_client = memorybackend.redis_clients()
+else:
+    try:
+        r = redis.Redis(**connection_options)
+
+        # Test the connection
+        r.ping()
+        print("Successfully connected to Redis at", REDIS_ENDPOINT)
+
+    except redis.AuthenticationError:
+        print("Authentication failed. Check your Redis key.")
+        raise
+    except Exception as e:
+        print(f"Connection failed: {e}")
+        raise
+
+    # Non-blocking client for the API; connections are opened lazily on the event loop
+    async_redis_client = aioredis.Redis(**connection_options)
+    # Same, returning bytes: for pre-serialized JSON that is sent without decoding
+    async_redis_raw_client = aioredis.Redis(**{**connection_options, "decode_responses": False})
 
 # Export a stable name for the rest of the codebase
 redis_client = r
+
+# Redis calls made while serving a request are counted in its metrics
+metrics.instrument_redis(async_redis_client)
+metrics.instrument_redis(async_redis_raw_client)
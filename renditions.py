@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+# Downscaled copies stored next to every uploaded photo, by longest edge in pixels.
+# The uploaded file itself is kept untouched as the "original" rendition.
+SIZES = {
+    "thumbnail": int(os.getenv("RENDITION_THUMBNAIL_SIZE", "320")),
+    "medium": int(os.getenv("RENDITION_MEDIUM_SIZE", "1280")),
+}
+JPEG_QUALITY = int(os.getenv("RENDITION_JPEG_QUALITY", "82"))
+WORKERS = int(os.getenv("RENDITION_WORKERS", str(min(4, os.cpu_count() or 1))))
+ENABLED = os.getenv("RENDITIONS_ENABLED", "true").lower() == "true"
+
+_pool = None
+
+
+def render(data: bytes) -> dict:
+    """
+    Decode an image once and re-encode it as a JPEG per SIZES entry, largest
+    first, each one downscaled from the previous. Returns {name: jpeg bytes};
+    sizes the image is already smaller than are skipped, and so is everything
+    when the data isn't a readable image.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("RGB", (max(SIZES.values()), max(SIZES.values())))
+        # Apply the camera orientation, as browsers would for the original
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning("Skipping renditions: %s", e)
+        return {}
+
+    renditions = {}
+    for name, size in sorted(SIZES.items(), key=lambda item: item[1], reverse=True):
+        if max(image.size) <= size:
+            continue
+        image = image.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        renditions[name] = output.getvalue()
+    return renditions
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the API process runs threads (event loop, SDK clients) that must not be forked
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def render_async(data: bytes) -> dict:
+    # Decoding and resizing is CPU bound; keep it off the event loop
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_pool(), render, data)
+    except (UnidentifiedImageError, OSError) as e:
+        # Renditions are optional; the original is still stored
+        logger.warning("Rendering failed: %s", e)
+        return {}
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
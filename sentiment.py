@@ -0,0 +1,77 @@
+from textblob.en import sentiment as lexicon  # the pattern lexicon TextBlob's default analyzer uses
+from textblob._text import EMOTICONS
+from typing import Iterable
+import numpy as np
+import os
+
+# Memoized polarity per distinct text; templated comments repeat a lot
+MEMO_SIZE = int(os.getenv("SENTIMENT_MEMO_SIZE", "50000"))
+_memo = {}
+
+# Tokens that can produce an assessment without being in the lexicon
+_SPECIAL_TOKENS = {e.lower() for emoticons in EMOTICONS.values() for e in emoticons} | {"(!)"}
+
+
+def tokenize(text: str) -> list:
+    # Same tokenization TextBlob(text).sentiment applies, done once per text
+    return [w.lower() for w in " ".join(lexicon.tokenizer(text)).split()]
+
+
+def _remember(text: str, polarity: float):
+    if len(_memo) >= MEMO_SIZE:
+        # Evict the oldest entry (dicts keep insertion order)
+        del _memo[next(iter(_memo))]
+    _memo[text] = polarity
+
+
+def _score_unique(texts: list) -> np.ndarray:
+    tokenized = [tokenize(text) for text in texts]
+
+    # Resolve the whole batch vocabulary against the lexicon in one pass, so
+    # texts without a single scoring token skip the assessment step entirely
+    vocabulary = set().union(*tokenized) if tokenized else set()
+    scoring = {w for w in vocabulary if w in lexicon or w in _SPECIAL_TOKENS}
+
+    owners, values = [], []
+    for i, tokens in enumerate(tokenized):
+        if scoring.isdisjoint(tokens):
+            continue
+        for _, p, _, _ in lexicon.assessments((w, None) for w in tokens):
+            owners.append(i)
+            values.append(p)
+
+    # Per-text mean of assessment polarities (0.0 when nothing was assessed)
+    owners = np.asarray(owners, dtype=np.intp)
+    sums = np.bincount(owners, weights=np.asarray(values, dtype=np.float64), minlength=len(texts))
+    counts = np.bincount(owners, minlength=len(texts))
+    return sums / np.maximum(counts, 1)
+
+
+def polarities(texts: Iterable[str]) -> np.ndarray:
+    """Polarity in [-1.0, 1.0] for each text, matching TextBlob(text).sentiment.polarity."""
+    texts = list(texts)
+    if not texts:
+        return np.zeros(0, dtype=np.float64)
+
+    unique, inverse = np.unique(np.asarray(texts, dtype=object), return_inverse=True)
+    unique_scores = np.empty(len(unique), dtype=np.float64)
+
+    missing = []
+    for i, text in enumerate(unique):
+        cached = _memo.get(text)
+        if cached is None:
+            missing.append(i)
+        else:
+            unique_scores[i] = cached
+
+    if missing:
+        scores = _score_unique([unique[i] for i in missing])
+        unique_scores[missing] = scores
+        for i, score in zip(missing, scores):
+            _remember(unique[i], float(score))
+
+    return unique_scores[inverse.reshape(-1)]
+
+
+def polarity(text: str) -> float:
+    return float(polarities([text])[0])
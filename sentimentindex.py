@@ -0,0 +1,173 @@
+from rediscache import async_redis_client as r
+from shared_code import queries
+import sentiment
+import asyncio
+import datetime
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of legoset ids scored by their average comment polarity
+MOST_LIKED_KEY = "most_liked_legosets"
+
+# Comments are deduplicated (both the API and the change feed processor record
+# every comment, and the feed may replay a batch) by the ids of the comments
+# created in the last DEDUPE_WINDOW seconds. Older comments are taken as counted:
+# the feed only delivers them again when they are edited (e.g. re-attributed to
+# deleted-user). If changefeed.py falls further behind than this, rebuild the
+# index (python sentimentindex.py).
+DEDUPE_WINDOW = int(os.getenv("SENTIMENT_DEDUPE_WINDOW", "86400"))
+
+# Adds one comment polarity to the running sum/count of a legoset and
+# re-scores it in the ranking, atomically so concurrent comments don't race.
+# KEYS[3] holds the recent comments already counted, scored by creation time;
+# it is trimmed to the window and expires once no comment is recent.
+_record_script = r.register_script("""
+if tonumber(ARGV[5]) < tonumber(ARGV[6]) then
+    return -2
+end
+if redis.call('ZSCORE', KEYS[3], ARGV[4]) then
+    return -1
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', '(' .. ARGV[6])
+redis.call('ZADD', KEYS[3], ARGV[5], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[7])
+local total = redis.call('HINCRBYFLOAT', KEYS[1], 'sum', ARGV[1])
+local count = redis.call('HINCRBY', KEYS[1], 'count', 1)
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[1], 'name', ARGV[2])
+end
+redis.call('ZADD', KEYS[2], tonumber(total) / count, ARGV[3])
+return count
+""")
+
+
+def stats_key(legoset_id: str) -> str:
+    return f"legoset_sentiment:{legoset_id}"
+
+
+def counted_key(legoset_id: str) -> str:
+    # Ids of the recent comments included in the legoset's sum/count
+    return f"legoset_sentiment:{legoset_id}:recent_comments"
+
+
+def created_timestamp(comment: dict) -> float:
+    # created_at is written by the API and populate_db; _ts (last write) otherwise
+    if comment.get("created_at"):
+        return datetime.datetime.fromisoformat(comment["created_at"]).timestamp()
+    return float(comment.get("_ts") or time.time())
+
+
+def score_text(text: str) -> float:
+    return sentiment.polarity(text)
+
+
+async def record_comment(legoset_id: str, comment_id: str, polarity: float, name: str = "",
+                         created: float = None):
+    """Count a comment created at `created` (epoch seconds, default now) once."""
+    now = time.time()
+    await _record_script(
+        keys=[stats_key(legoset_id), MOST_LIKED_KEY, counted_key(legoset_id)],
+        args=[polarity, name or "", legoset_id, comment_id, now if created is None else created,
+              now - DEDUPE_WINDOW, DEDUPE_WINDOW]
+    )
+
+
+async def rename_legoset(legoset_id: str, name: str):
+    # Only touch legosets that are already ranked
+    if await r.exists(stats_key(legoset_id)):
+        await r.hset(stats_key(legoset_id), "name", name)
+
+
+async def remove_legoset(legoset_id: str):
+    pipe = r.pipeline()
+    pipe.zrem(MOST_LIKED_KEY, legoset_id)
+    pipe.delete(stats_key(legoset_id), counted_key(legoset_id))
+    await pipe.execute()
+
+
+async def top_legosets(limit: int = 10) -> list:
+    if limit <= 0:
+        return []
+    ranked = await r.zrevrange(MOST_LIKED_KEY, 0, limit - 1, withscores=True)
+    pipe = r.pipeline()
+    for legoset_id, _ in ranked:
+        pipe.hget(stats_key(legoset_id), "name")
+    names = await pipe.execute()
+    return [
+        {"legoset_id": legoset_id, "name": name, "score": score}
+        for (legoset_id, score), name in zip(ranked, names)
+    ]
+
+
+async def rebuild_index(legosets_container, comments_container):
+    """Backfill the index from scratch with one pass over the comments container."""
+    comments = await queries.fetch(comments_container, queries.COMMENT_TEXTS)
+
+    # Comments written before scoring-on-write are scored here in one batch
+    unscored = [c for c in comments if c.get("polarity") is None]
+    for comment, polarity in zip(unscored, sentiment.polarities(c["text"] for c in unscored)):
+        comment["polarity"] = float(polarity)
+
+    totals = {}
+    recent = {}
+    cutoff = time.time() - DEDUPE_WINDOW
+    for comment in comments:
+        total, count = totals.get(comment["legoset_id"], (0.0, 0))
+        totals[comment["legoset_id"]] = (total + comment["polarity"], count + 1)
+        created = created_timestamp(comment)
+        if created >= cutoff:
+            recent.setdefault(comment["legoset_id"], {})[comment["id"]] = created
+
+    names = {legoset["id"]: legoset["name"] for legoset in await queries.fetch(legosets_container, queries.LEGOSET_NAMES)}
+
+    ranked = {
+        legoset_id: (total, count)
+        for legoset_id, (total, count) in totals.items()
+        if legoset_id in names
+    }
+
+    # Drop stats (and counted comments) of legosets that no longer have comments (or no longer exist)
+    stale = [key async for key in r.scan_iter(match=stats_key("*"))]
+    staging_key = f"{MOST_LIKED_KEY}:rebuild"
+
+    pipe = r.pipeline()
+    if stale:
+        pipe.delete(*stale)
+    pipe.delete(staging_key)
+    for legoset_id, (total, count) in ranked.items():
+        pipe.hset(stats_key(legoset_id), mapping={"sum": total, "count": count, "name": names[legoset_id]})
+        if legoset_id in recent:
+            pipe.zadd(counted_key(legoset_id), recent[legoset_id])
+            pipe.expire(counted_key(legoset_id), DEDUPE_WINDOW)
+        pipe.zadd(staging_key, {legoset_id: total / count})
+    # Swap the ranking in the same transaction so readers never see a half-built index
+    if ranked:
+        pipe.rename(staging_key, MOST_LIKED_KEY)
+    else:
+        pipe.delete(MOST_LIKED_KEY)
+    await pipe.execute()
+
+    logger.info("Rebuilt sentiment index for %d legosets", len(ranked))
+    return len(ranked)
+
+
+async def _rebuild():
+    import cosmosdb
+
+    database = await cosmosdb.init_async_database()
+    try:
+        return await rebuild_index(
+            database.get_container_client("legosets"),
+            database.get_container_client("comments")
+        )
+    finally:
+        await cosmosdb.close_async_database()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = asyncio.run(_rebuild())
+    print(f"Sentiment index rebuilt for {count} lego sets")
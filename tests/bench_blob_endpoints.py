@@ -0,0 +1,88 @@
+# Latency of the blob work behind GET /rest/media/{blob_name} and
+# POST /rest/legoset: a new BlobStorageManager per request (client setup plus
+# a create_container round trip) vs the shared process-wide manager.
+#
+# Uses the same local stand-in as bench_blob_upload.py (or a real Azurite via
+# AZURITE_CONNECTION_STRING). Run from the repository root:
+#   python tests/bench_blob_endpoints.py [requests]
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_blob_upload import open_images, start_standin
+import blobstorage
+
+
+async def media_per_request():
+    async with blobstorage.BlobStorageManager() as blob_manager:
+        return blob_manager.get_image_url("bench/photo.jpg")
+
+
+async def media_shared():
+    return blobstorage.get_blob_manager().get_image_url("bench/photo.jpg")
+
+
+async def legoset_per_request():
+    files = open_images(3)
+    try:
+        async with blobstorage.BlobStorageManager() as blob_manager:
+            return await blob_manager.upload_legoset_images(files, "bench")
+    finally:
+        for file in files:
+            file.file.close()
+
+
+async def legoset_shared():
+    files = open_images(3)
+    try:
+        return await blobstorage.get_blob_manager().upload_legoset_images(files, "bench")
+    finally:
+        for file in files:
+            file.file.close()
+
+
+async def measure(call, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summary(timings: list) -> str:
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    return f"mean {statistics.mean(timings):7.1f} ms  p95 {p95:7.1f} ms"
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    runner = None
+    connection_string = os.getenv("AZURITE_CONNECTION_STRING")
+    if not connection_string:
+        runner, connection_string = await start_standin()
+    blobstorage.STORAGE_CONNECTION_STRING = connection_string
+
+    try:
+        await blobstorage.init_blob_storage()
+        for name, per_request, shared in (
+            ("GET /rest/media/{blob_name}", media_per_request, media_shared),
+            ("POST /rest/legoset (3 images)", legoset_per_request, legoset_shared),
+        ):
+            print(name)
+            print(f"  per-request manager: {summary(await measure(per_request, requests))}")
+            print(f"  shared manager:      {summary(await measure(shared, requests))}")
+    finally:
+        await blobstorage.close_blob_storage()
+        if runner:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
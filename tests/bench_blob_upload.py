@@ -0,0 +1,105 @@
+# Wall time of BlobStorageManager.upload_legoset_images for 1, 3 and 10 images,
+# sequential vs concurrent, against a local blob endpoint.
+#
+# By default a minimal Azurite-style stand-in is started in-process; it accepts
+# container/blob/block PUTs and simulates per-request latency and bandwidth.
+# Set AZURITE_CONNECTION_STRING to benchmark against a real Azurite instead.
+#
+# Run from the repository root: python tests/bench_blob_upload.py
+import asyncio
+import os
+import sys
+import time
+import email.utils
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from aiohttp import web
+from starlette.datastructures import Headers, UploadFile
+import blobstorage
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
+LATENCY = float(os.getenv("STANDIN_LATENCY", "0.05"))          # seconds per request
+BANDWIDTH = float(os.getenv("STANDIN_BANDWIDTH", str(20e6)))   # bytes per second per request
+# Well-known Azurite development account
+ACCOUNT = "devstoreaccount1"
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+async def handle_put(request: web.Request) -> web.Response:
+    body = await request.read()
+    await asyncio.sleep(LATENCY + len(body) / BANDWIDTH)
+    return web.Response(status=201, headers={
+        "ETag": '"0x8D000000000000"',
+        "Last-Modified": email.utils.formatdate(usegmt=True),
+        "x-ms-request-id": "standin",
+        "x-ms-version": "2021-12-02",
+        "x-ms-request-server-encrypted": "true",
+    })
+
+
+async def start_standin():
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_put("/{tail:.*}", handle_put)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    connection_string = (
+        f"DefaultEndpointsProtocol=http;AccountName={ACCOUNT};AccountKey={ACCOUNT_KEY};"
+        f"BlobEndpoint=http://127.0.0.1:{port}/{ACCOUNT};"
+    )
+    return runner, connection_string
+
+
+def open_images(count: int) -> list:
+    names = sorted(f for f in os.listdir(IMAGES_DIR) if f.endswith(".jpg"))[:count]
+    files = []
+    for name in names:
+        path = os.path.join(IMAGES_DIR, name)
+        files.append(UploadFile(
+            file=open(path, "rb"),
+            size=os.path.getsize(path),
+            filename=name,
+            headers=Headers({"content-type": "image/jpeg"}),
+        ))
+    return files
+
+
+async def timed_upload(count: int, concurrency: int) -> float:
+    blobstorage.UPLOAD_CONCURRENCY = concurrency
+    files = open_images(count)
+    try:
+        async with blobstorage.BlobStorageManager() as blob_manager:
+            start = time.perf_counter()
+            uploaded, failed = await blob_manager.upload_legoset_images(files, "bench")
+            elapsed = time.perf_counter() - start
+        assert not failed, failed
+        assert len(uploaded) == count
+        return elapsed
+    finally:
+        for file in files:
+            file.file.close()
+
+
+async def main():
+    runner = None
+    connection_string = os.getenv("AZURITE_CONNECTION_STRING")
+    if not connection_string:
+        runner, connection_string = await start_standin()
+    blobstorage.STORAGE_CONNECTION_STRING = connection_string
+
+    try:
+        print(f"{'images':>6} {'sequential':>12} {'concurrent':>12} {'speedup':>8}")
+        for count in (1, 3, 10):
+            sequential = await timed_upload(count, 1)
+            concurrent = await timed_upload(count, int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "4")))
+            print(f"{count:>6} {sequential:>11.3f}s {concurrent:>11.3f}s {sequential / concurrent:>7.1f}x")
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+# Per-endpoint latency and simulated Cosmos DB request charge on the in-memory
+# backend (STORAGE_BACKEND=memory, see memorybackend.py): no Azure service or
+# Redis is needed, and a given --seed always generates the same dataset, so
+# runs can be compared between commits.
+#
+# Requests go through the ASGI app in-process, one at a time, so the numbers
+# leave out the network and the server; request charges are estimates.
+#
+# Run from the repository root:
+#   python tests/bench_endpoints.py --legosets 5000 --comments 20000 --requests 200
+import os
+import sys
+
+os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from faker import Faker
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import httpx
+import cosmosdb
+import main
+import populate_db
+import sentimentindex
+
+
+async def seed(args) -> dict:
+    random.seed(args.seed)
+    Faker.seed(args.seed)
+    dataset = populate_db.generate_dataset(args.users, args.legosets, args.comments, args.auctions,
+                                           args.max_bids, photos=[])
+    for name, docs in dataset.items():
+        await populate_db.upsert_all(cosmosdb.database.get_container_client(name), docs, concurrency=1)
+    await sentimentindex.rebuild_index(cosmosdb.database.get_container_client("legosets"),
+                                       cosmosdb.database.get_container_client("comments"))
+    return dataset
+
+
+def cosmos_totals():
+    containers = [cosmosdb.database.get_container_client(name)
+                  for name in ("users", "legosets", "comments", "auctions", "bids")]
+    return (sum(container.stats["requests"] for container in containers),
+            sum(container.stats["request_charge"] for container in containers))
+
+
+async def measure(client: httpx.AsyncClient, label: str, request, count: int):
+    await request(client)  # warm-up: fills the caches the endpoint reads through
+    latencies = []
+    requests_before, charge_before = cosmos_totals()
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await request(client)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, f"{label}: {response.status_code} {response.text}"
+    requests_after, charge_after = cosmos_totals()
+    latencies.sort()
+    print(f"  {label:<34} p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.2f} ms  "
+          f"{(requests_after - requests_before) / count:5.1f} Cosmos calls  "
+          f"{(charge_after - charge_before) / count:7.2f} RU  per request")
+
+
+async def run(args):
+    start = time.perf_counter()
+    dataset = await seed(args)
+    print(f"{args.users} users, {args.legosets} legosets, {args.comments} comments, "
+          f"{args.auctions} auctions (seed {args.seed}), loaded in {time.perf_counter() - start:.1f}s")
+
+    for handler in main.app.router.on_startup:
+        await handler()
+    rng = random.Random(args.seed)
+    users = [user["id"] for user in dataset["users"]]
+    # Each bid beats the previous one on its auction
+    prices = {auction["id"]: max(auction["base_price"], auction["highest_bid"] or 0)
+              for auction in dataset["auctions"]}
+    cursor = None
+
+    async def list_legosets(client):
+        return await client.get("/rest/legoset")
+
+    async def list_legosets_page(client):
+        nonlocal cursor
+        response = await client.get("/rest/legoset", params={"limit": 50, **({"cursor": cursor} if cursor else {})})
+        cursor = response.json()["next_cursor"]
+        return response
+
+    async def most_liked(client):
+        return await client.get("/rest/legoset/most-liked")
+
+    async def get_user(client):
+        return await client.get(f"/rest/user/{rng.choice(users)}")
+
+    async def bid(client):
+        auction_id = rng.choice(list(prices))
+        prices[auction_id] = round(prices[auction_id] + 1, 2)
+        return await client.post(f"/rest/auction/{auction_id}/bid", json={
+            "auction_id": auction_id, "bidder_id": rng.choice(users), "amount": prices[auction_id]
+        })
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{args.requests} requests each")
+        await measure(client, "GET /rest/legoset (cached)", list_legosets, args.requests)
+        await measure(client, "GET /rest/legoset?limit=50", list_legosets_page, args.requests)
+        await measure(client, "GET /rest/legoset/most-liked", most_liked, args.requests)
+        await measure(client, "GET /rest/user/{id}", get_user, args.requests)
+        if prices:
+            await measure(client, "POST /rest/auction/{id}/bid", bid, args.requests)
+
+    for handler in main.app.router.on_shutdown:
+        await handler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-endpoint benchmarks on the in-memory backend")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--legosets", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--auctions", type=int, default=300)
+    parser.add_argument("--max-bids", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
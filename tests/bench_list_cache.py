@@ -0,0 +1,89 @@
+# Requests/sec of a cached GET /rest/legoset: the previous cache hit (json.loads
+# of the stored entry, then jsonable_encoder + JSONResponse) vs the stored
+# orjson bytes returned as they are.
+#
+# Needs Redis (REDIS_ENDPOINT etc., as for the API) - use a scratch instance:
+# Cosmos is not used, the legoset cache is filled with generated documents
+# instead. Requests go through the ASGI app in-process, so the numbers leave
+# out the network and the server.
+#
+# Run from the repository root: python tests/bench_list_cache.py [legosets] [seconds]
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.responses import JSONResponse
+import httpx
+import entitycache
+import main
+
+LEGACY_KEY = "bench:legosets_list:legacy"
+CONCURRENCY = 8
+
+
+def generate_legosets(count: int) -> list:
+    return [{
+        "id": str(uuid.uuid4()),
+        "pk": "LEGOSET",
+        "name": f"Lego set {i}",
+        "code_number": f"{1000 + i % 9000}-{i % 9 + 1}",
+        "description": "A detailed model with over a thousand pieces and a display stand. " * 2,
+        "photo_blob_names": [f"set{i}/{uuid.uuid4()}.jpg" for _ in range(i % 3 + 1)],
+        "owner_id": str(uuid.uuid4()),
+        "created_at": "2025-11-01T12:00:00",
+    } for i in range(count)]
+
+
+async def legacy_list_legosets():
+    # The cache hit as it was: decode the entry, let FastAPI re-encode the value
+    entry = json.loads(await entitycache.r.get(LEGACY_KEY))
+    return entry["value"]
+
+
+async def measure(client: httpx.AsyncClient, path: str, seconds: float):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    size = len((await client.get(path)).content)
+    return len(latencies) / elapsed, statistics.median(latencies) * 1000, size
+
+
+async def run(count: int, seconds: float):
+    legosets = generate_legosets(count)
+    await entitycache.fill("legosets", legosets, await entitycache.version("legosets"))
+    value = [main.LegoSetOutput(**legoset).model_dump() for legoset in legosets]
+    await entitycache.r.setex(LEGACY_KEY, 600, json.dumps({"value": value, "delta": 0.1, "expiry": time.time() + 600}))
+    main.app.add_api_route("/bench/legoset/legacy", legacy_list_legosets, response_class=JSONResponse)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/rest/legoset")  # fills the list cache
+        print(f"{count} legosets, {CONCURRENCY} concurrent clients, {seconds:.0f}s each")
+        for label, path in (("before (json + jsonable_encoder)", "/bench/legoset/legacy"),
+                            ("after (stored orjson bytes)", "/rest/legoset")):
+            rps, p50, size = await measure(client, path, seconds)
+            print(f"  {label:<34} {rps:8.1f} req/s  p50 {p50:7.2f} ms  ({size / 1024:.0f} KiB)")
+
+    await entitycache.r.delete(LEGACY_KEY)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(run(count, seconds))
@@ -0,0 +1,116 @@
+# Repeated lookups with the values formatted into the query text (how main.py
+# built them before shared_code/queries.py) vs the named, parameterized queries: p50/p95
+# latency and request charge per lookup.
+#
+# By default this runs on the in-memory backend (STORAGE_BACKEND=memory) with
+# a seeded dataset. There a new query text costs a parse, like a query plan
+# (memorybackend.PLAN_CACHE_SIZE), but the simulated charge does not depend on
+# the text. --azure reads from the Cosmos DB account configured in .env
+# instead, for real latencies and request charges; it doesn't write anything.
+#
+# Run from the repository root:
+#   python tests/bench_queries.py --lookups 500
+#   python tests/bench_queries.py --azure --lookups 200
+import os
+import sys
+
+if "--azure" not in sys.argv:
+    os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from faker import Faker
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import cosmosdb
+import memorybackend
+import populate_db
+from shared_code import queries
+
+# (name, container, named query, parameter, formatted text as it used to be built, partition key of a lookup?)
+LOOKUPS = [
+    ("comments of a legoset", "comments", queries.COMMENTS_OF_LEGOSET, "legoset_id",
+     "SELECT * FROM c WHERE c.legoset_id='{}'", True),
+    ("legosets of an owner", "legosets", queries.LEGOSETS_OF_OWNER, "owner_id",
+     "SELECT * FROM c WHERE c.owner_id = '{}'", False),
+    ("highest bid of an auction", "bids", queries.HIGHEST_BID, "auction_id",
+     "SELECT TOP 1 * FROM c WHERE c.auction_id='{}' ORDER BY c.amount DESC", True),
+]
+
+
+IDS = queries.Query("bench_ids", "SELECT VALUE c.id FROM c")
+
+
+async def lookup_values(database, rng: random.Random, count: int) -> dict:
+    """`count` values to look up per parameter, drawn from the stored documents."""
+    ids = {
+        "legoset_id": await queries.fetch(database.get_container_client("legosets"), IDS),
+        "owner_id": await queries.fetch(database.get_container_client("users"), IDS),
+        "auction_id": await queries.fetch(database.get_container_client("auctions"), IDS),
+    }
+    return {name: [rng.choice(values) for _ in range(count)] for name, values in ids.items() if values}
+
+
+async def run_lookups(container, values: list, partitioned: bool, bind):
+    latencies, charges = [], []
+    plans_before = memorybackend.plan_stats["misses"]
+    for value in values:
+        charge = queries.Charge()
+        options = {"partition_key": value} if partitioned else {}
+        start = time.perf_counter()
+        async for _ in container.query_items(**bind(value), response_hook=charge, **options):
+            pass
+        latencies.append(time.perf_counter() - start)
+        charges.append(charge.total)
+    latencies.sort()
+    return (statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], statistics.mean(charges),
+            (memorybackend.plan_stats["misses"] - plans_before) / len(values))
+
+
+async def run(args):
+    if memorybackend.ENABLED:
+        random.seed(args.seed)
+        Faker.seed(args.seed)
+        dataset = populate_db.generate_dataset(args.users, args.legosets, args.comments, args.auctions,
+                                               args.max_bids, photos=[])
+        for name, docs in dataset.items():
+            await populate_db.upsert_all(cosmosdb.database.get_container_client(name), docs, concurrency=1)
+        print(f"In-memory backend: {args.users} users, {args.legosets} legosets, {args.comments} comments, "
+              f"{args.auctions} auctions (seed {args.seed})")
+    database = await cosmosdb.init_async_database()
+    if database is None:
+        raise RuntimeError("Cosmos DB is not configured")
+
+    try:
+        values = await lookup_values(database, random.Random(args.seed), args.lookups)
+        print(f"{args.lookups} lookups each")
+        for label, container_name, query, parameter, formatted, partitioned in LOOKUPS:
+            if parameter not in values:
+                continue
+            container = database.get_container_client(container_name)
+            for variant, bind in (
+                ("formatted", lambda value: {"query": formatted.format(value)}),
+                ("parameterized", lambda value: query.bind({parameter: value})),
+            ):
+                p50, p95, charge, plans = await run_lookups(container, values[parameter], partitioned, bind)
+                line = f"  {label:<27} {variant:<14} p50 {p50 * 1000:7.3f} ms  p95 {p95 * 1000:7.3f} ms  {charge:6.2f} RU"
+                if memorybackend.ENABLED:
+                    line += f"  {plans:4.2f} plans compiled"
+                print(line + "  per lookup")
+    finally:
+        await cosmosdb.close_async_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Formatted vs parameterized query lookups")
+    parser.add_argument("--azure", action="store_true", help="use the Cosmos DB account from .env")
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--legosets", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--auctions", type=int, default=300)
+    parser.add_argument("--max-bids", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,107 @@
+# Bytes served per legoset list page with original, medium and thumbnail
+# photos, and the cost of rendering them: inline on the event loop vs in the
+# process pool, including the longest time the event loop could not serve
+# other requests.
+#
+# Two photo sets: the sample images in tests/images as they are, and the same
+# images upscaled to a 12 MP phone-camera size, which is what users upload.
+#
+# Run from the repository root: python tests/bench_renditions.py [page_size]
+import asyncio
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image
+import pagination
+import renditions
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
+CAMERA_SIZE = (4032, 3024)
+
+
+def sample_photos() -> list:
+    names = sorted(f for f in os.listdir(IMAGES_DIR) if f.endswith(".jpg"))
+    photos = []
+    for name in names:
+        with open(os.path.join(IMAGES_DIR, name), "rb") as f:
+            photos.append(f.read())
+    return photos
+
+
+def camera_photos(photos: list, count: int = 8) -> list:
+    upscaled = []
+    for data in photos[:count]:
+        image = Image.open(io.BytesIO(data)).convert("RGB").resize(CAMERA_SIZE, Image.Resampling.BICUBIC)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=90)
+        upscaled.append(output.getvalue())
+    return upscaled
+
+
+def page_bytes(photos: list, rendered: list, page_size: int) -> dict:
+    # A list page shows one photo per legoset; cycle through the photo set
+    sizes = ["original", *renditions.SIZES]
+    totals = dict.fromkeys(sizes, 0)
+    for i in range(page_size):
+        original, renders = photos[i % len(photos)], rendered[i % len(rendered)]
+        for size in sizes:
+            totals[size] += len(renders.get(size, original))
+    return totals
+
+
+async def timed_render(photos: list, pooled: bool):
+    # Returns the renditions, the wall time and the longest event loop stall
+    stalls = []
+    done = False
+
+    async def ticker():
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    if pooled:
+        rendered = await asyncio.gather(*(renditions.render_async(data) for data in photos))
+    else:
+        rendered = [renditions.render(data) for data in photos]
+    elapsed = time.perf_counter() - start
+    done = True
+    await tick
+    return rendered, elapsed, max(stalls)
+
+
+def report(label: str, photos: list, page_size: int):
+    renditions.get_pool().submit(renditions.render, photos[0]).result()  # start the workers
+    rendered, inline_time, inline_stall = asyncio.run(timed_render(photos, pooled=False))
+    _, pool_time, pool_stall = asyncio.run(timed_render(photos, pooled=True))
+
+    print(f"{label}: {len(photos)} photos")
+    print(f"  render inline:   {inline_time / len(photos) * 1000:8.1f} ms/photo, "
+          f"event loop blocked up to {inline_stall * 1000:7.1f} ms")
+    print(f"  render pooled:   {pool_time / len(photos) * 1000:8.1f} ms/photo, "
+          f"event loop blocked up to {pool_stall * 1000:7.1f} ms ({renditions.WORKERS} workers)")
+    totals = page_bytes(photos, rendered, page_size)
+    for size, total in totals.items():
+        print(f"  page of {page_size} ({size + '):':<11} {total / 1024:10.1f} KiB "
+              f"({total / totals['original']:6.1%} of original)")
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else pagination.DEFAULT_PAGE_SIZE
+    photos = sample_photos()
+    report("tests/images", photos, page_size)
+    report(f"{CAMERA_SIZE[0]}x{CAMERA_SIZE[1]} camera photos", camera_photos(photos), page_size)
+    renditions.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Parity check and throughput benchmark for sentiment.py against TextBlob.
+# Run from the repository root: python tests/bench_sentiment.py [comment_count]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from textblob import TextBlob
+import numpy as np
+import sentiment
+
+TEMPLATES = [
+    "I recently purchased the {product} and it was such a fun building experience!",
+    "The {product} is amazing! It took me several hours to assemble.",
+    "I was impressed by the detail and quality of the {product}.",
+    "I love the {product}! It's the perfect mix of creativity and complexity.",
+    "Absolutely fantastic! {product} exceeded my expectations.",
+    "I can't stop looking at my completed {product} — it looks incredible!",
+    "I was disappointed by the {product}, it felt cheaply made.",
+    "The {product} was frustrating to assemble and took longer than expected.",
+    "The {product} is overrated and not worth the price.",
+    "Instructions for {product} were confusing and unclear.",
+    "I regret buying the {product}, it didn't meet my expectations.",
+]
+
+PRODUCTS = ["Millennium Falcon", "Hogwarts Castle", "Robust optimal hub", "Very bad idea kit", "Tiny house"]
+
+# Hand-written cases for negation, modifiers, exclamation marks and emoticons
+EDGE_CASES = [
+    "",
+    "not good",
+    "not a good set",
+    "really not good",
+    "very very good!!",
+    "this is not bad at all :)",
+    "Terrible (!)",
+    "meh :-( but the box was nice",
+    "Never again. Horrible, horrible instructions!",
+    "12345 -- ?!",
+]
+
+
+def corpus(size: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    texts = [rng.choice(TEMPLATES).format(product=rng.choice(PRODUCTS)) for _ in range(size)]
+    return texts + EDGE_CASES
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    texts = corpus(size)
+
+    start = time.perf_counter()
+    expected = np.array([TextBlob(text).sentiment.polarity for text in texts])
+    textblob_time = time.perf_counter() - start
+
+    sentiment._memo.clear()
+    start = time.perf_counter()
+    cold = sentiment.polarities(texts)
+    cold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warm = sentiment.polarities(texts)
+    warm_time = time.perf_counter() - start
+
+    mismatch = float(np.max(np.abs(expected - cold)))
+    print(f"texts:           {len(texts)} ({len(set(texts))} distinct)")
+    print(f"max |delta|:     {mismatch:.3g}")
+    print(f"TextBlob loop:   {textblob_time:.3f}s ({len(texts) / textblob_time:,.0f} texts/s)")
+    print(f"batch (cold):    {cold_time:.3f}s ({len(texts) / cold_time:,.0f} texts/s)")
+    print(f"batch (memo):    {warm_time:.3f}s ({len(texts) / warm_time:,.0f} texts/s)")
+
+    if mismatch > 1e-9 or np.any(cold != warm):
+        print("Parity check FAILED")
+        sys.exit(1)
+    print("Parity check passed")
+
+
+if __name__ == "__main__":
+    main()
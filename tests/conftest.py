@@ -0,0 +1,20 @@
+# The tests run against the in-memory backend (STORAGE_BACKEND=memory, see
+# memorybackend.py): fakeredis and in-process Cosmos DB containers, so they
+# need neither Azure nor Redis.
+# Run from the repository root: python -m pytest tests
+import asyncio
+import os
+import sys
+
+os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Run a coroutine to completion. One event loop for the session, as in a worker process."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
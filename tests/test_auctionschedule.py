@@ -0,0 +1,63 @@
+from rediscache import async_redis_client as r
+import asyncio
+import auctionschedule
+import cosmosdb
+import datetime
+import entitycache
+import time
+import uuid
+
+
+def test_due_auction_is_claimed_once(run):
+    async def scenario():
+        await r.delete(auctionschedule.SCHEDULE_KEY, auctionschedule.CLAIMS_KEY)
+        due, later = str(uuid.uuid4()), str(uuid.uuid4())
+        await r.zadd(auctionschedule.SCHEDULE_KEY, {due: time.time() - 1, later: time.time() + 3600})
+
+        # Replicas claiming at the same time
+        claims = await asyncio.gather(*(auctionschedule.claim_due(10) for _ in range(10)))
+        claimed = [auction_id for claim in claims for auction_id, _ in claim]
+        assert claimed == [due]
+        assert await r.zscore(auctionschedule.CLAIMS_KEY, due) is not None
+        assert await r.zrange(auctionschedule.SCHEDULE_KEY, 0, -1) == [later]
+
+    run(scenario())
+
+
+def test_expired_claim_is_claimed_again(run):
+    async def scenario():
+        await r.delete(auctionschedule.SCHEDULE_KEY, auctionschedule.CLAIMS_KEY)
+        auction_id = str(uuid.uuid4())
+        # Claimed by a replica that died; its claim has expired
+        await r.zadd(auctionschedule.CLAIMS_KEY, {auction_id: time.time() - 1})
+
+        claims = await asyncio.gather(*(auctionschedule.claim_due(10) for _ in range(5)))
+        assert [claimed for claim in claims for claimed, _ in claim] == [auction_id]
+
+    run(scenario())
+
+
+def test_closing_with_the_cache_disabled_leaves_it_alone(run, monkeypatch):
+    monkeypatch.setattr(entitycache, "ENABLED", False)
+
+    async def put(*args):
+        raise AssertionError("entity cache written while disabled")
+
+    monkeypatch.setattr(entitycache, "put", put)
+
+    async def scenario():
+        auctions = cosmosdb.database.get_container_client("auctions")
+        bids = cosmosdb.database.get_container_client("bids")
+        legoset_id = str(uuid.uuid4())
+        auction = {
+            "id": str(uuid.uuid4()), "pk": legoset_id, "legoset_id": legoset_id, "status": "open",
+            "close_date": (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)).isoformat(),
+            "highest_bid": 20.0, "highest_bidder_id": "bidder", "bid_count": 1,
+        }
+        await auctions.create_item(auction)
+
+        assert await auctionschedule.close_auction(auctions, bids, auction["id"])
+        closed = await auctions.read_item(item=auction["id"], partition_key=legoset_id)
+        assert (closed["status"], closed["winner_id"]) == ("closed", "bidder")
+
+    run(scenario())
@@ -0,0 +1,116 @@
+from shared_code import queries
+from azure.cosmos import exceptions
+import asyncio
+import datetime
+import httpx
+import pytest
+import uuid
+
+
+@pytest.fixture(scope="module")
+def api(run):
+    import main
+    for handler in main.app.router.on_startup:
+        run(handler())
+    yield main
+    for handler in main.app.router.on_shutdown:
+        run(handler())
+
+
+async def create_auction(main, bidders: int):
+    bidder_ids = [str(uuid.uuid4()) for _ in range(bidders)]
+    for bidder_id in bidder_ids:
+        await main.users_container.create_item({
+            "id": bidder_id, "pk": "USER", "nickname": bidder_id, "name": "Bidder", "password": "",
+            "photo_url": "", "owned_sets": [],
+        })
+    legoset_id = str(uuid.uuid4())
+    auction = {
+        "id": str(uuid.uuid4()), "pk": legoset_id, "legoset_id": legoset_id, "seller_id": "seller",
+        "base_price": 10.0, "status": "open",
+        "close_date": (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)).isoformat(),
+        "highest_bid": None, "highest_bidder_id": None, "bid_count": 0,
+    }
+    await main.auctions_container.create_item(auction)
+    return auction, bidder_ids
+
+
+class RacingReplaces:
+    """Holds the first `racers` replace_item calls until all of them were made, so they use the same ETag."""
+    def __init__(self, container, racers: int):
+        self._container = container
+        self._barrier = asyncio.Barrier(racers)
+        self._waiting = racers
+        self.etags = []
+
+    def __getattr__(self, name):
+        return getattr(self._container, name)
+
+    async def replace_item(self, *args, **kwargs):
+        if self._waiting:
+            self._waiting -= 1
+            self.etags.append(kwargs["etag"])
+            await self._barrier.wait()
+        return await self._container.replace_item(*args, **kwargs)
+
+
+def test_racing_bids_on_one_etag_accept_exactly_one(api, run, monkeypatch):
+    async def scenario():
+        auction, bidder_ids = await create_auction(api, bidders=2)
+        racing = RacingReplaces(api.auctions_container, racers=2)
+        monkeypatch.setattr(api, "auctions_container", racing)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            responses = await asyncio.gather(*(
+                client.post(f"/rest/auction/{auction['id']}/bid",
+                            json={"auction_id": auction["id"], "bidder_id": bidder_id, "amount": 50})
+                for bidder_id in bidder_ids
+            ))
+        monkeypatch.undo()
+
+        assert len(set(racing.etags)) == 1
+        assert sorted(response.status_code for response in responses) == [200, 403]
+        winner = next(response.json() for response in responses if response.status_code == 200)
+
+        stored = await api.auctions_container.read_item(item=auction["id"], partition_key=auction["pk"])
+        assert stored["highest_bidder_id"] == winner["bidder_id"]
+        assert stored["highest_bid_id"] == winner["id"]
+        assert stored["bid_count"] == 1
+        # The rejected bid was deleted again
+        bids = api.bids_container
+        parameters = {"auction_id": auction["id"]}
+        assert await queries.fetch(bids, queries.BID_COUNT, parameters, partition_key=auction["id"]) == [1]
+        highest = await queries.fetch(bids, queries.HIGHEST_BID, parameters, partition_key=auction["id"])
+        assert highest == [{"bidder_id": winner["bidder_id"], "amount": 50.0}]
+
+    run(scenario())
+
+
+class FailingReplaces:
+    """Fails every replace_item call the way an unavailable Cosmos DB would."""
+    def __init__(self, container):
+        self._container = container
+
+    def __getattr__(self, name):
+        return getattr(self._container, name)
+
+    async def replace_item(self, *args, **kwargs):
+        raise exceptions.CosmosHttpResponseError(status_code=503, message="Service unavailable")
+
+
+def test_failed_replace_deletes_the_bid(api, run, monkeypatch):
+    async def scenario():
+        auction, bidder_ids = await create_auction(api, bidders=1)
+        monkeypatch.setattr(api, "auctions_container", FailingReplaces(api.auctions_container))
+
+        transport = httpx.ASGITransport(app=api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(f"/rest/auction/{auction['id']}/bid",
+                                         json={"auction_id": auction["id"], "bidder_id": bidder_ids[0], "amount": 50})
+        monkeypatch.undo()
+
+        assert response.status_code == 500
+        parameters = {"auction_id": auction["id"]}
+        assert await queries.fetch(api.bids_container, queries.BID_COUNT, parameters, partition_key=auction["id"]) == [0]
+
+    run(scenario())
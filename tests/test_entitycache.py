@@ -0,0 +1,42 @@
+from rediscache import async_redis_client as r
+import asyncio
+import entitycache
+import orjson
+import uuid
+
+
+def test_concurrent_misses_load_once(run):
+    calls = 0
+
+    @entitycache.single_flight("legosets", "test_list:{name}")
+    async def load(name: str):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return [{"name": name}]
+
+    async def scenario(name: str):
+        return await asyncio.gather(*(load(name=name) for _ in range(20)))
+
+    name = str(uuid.uuid4())
+    payloads = run(scenario(name))
+    assert calls == 1
+    assert all(orjson.loads(payload) == [{"name": name}] for payload in payloads)
+
+
+def test_lock_is_released_only_by_its_owner(run):
+    async def scenario():
+        lock_key = f"lock:test:{uuid.uuid4()}"
+        token = await entitycache._acquire(lock_key)
+        assert token
+        assert await entitycache._acquire(lock_key) is None
+
+        # The lock expired during a slow recompute and another worker took it
+        await r.set(lock_key, "other-token")
+        await entitycache._release_script(keys=[lock_key], args=[token])
+        assert await r.get(lock_key) == "other-token"
+
+        await entitycache._release_script(keys=[lock_key], args=["other-token"])
+        assert await r.get(lock_key) is None
+
+    run(scenario())
@@ -0,0 +1,51 @@
+from rediscache import async_redis_client as r
+import asyncio
+import jobs
+import uuid
+
+
+def start_blocked_job(subject: str):
+    """A job that runs until the returned event is set."""
+    done = asyncio.Event()
+
+    async def work(progress):
+        await done.wait()
+        await progress(steps=1)
+
+    return jobs.start("test", subject, work), done
+
+
+def test_job_releases_its_lock(run):
+    async def scenario():
+        subject = str(uuid.uuid4())
+        start, done = start_blocked_job(subject)
+        job = await start
+        lock = jobs._lock_key("test", subject)
+        assert await r.get(lock) == job["id"]
+
+        done.set()
+        await asyncio.gather(*jobs._tasks)
+        assert (await jobs.get(job["id"]))["status"] == "succeeded"
+        assert await r.get(lock) is None
+
+    run(scenario())
+
+
+def test_lock_taken_over_is_left_to_its_new_owner(run):
+    async def scenario():
+        subject = str(uuid.uuid4())
+        start, done = start_blocked_job(subject)
+        job = await start
+        lock = jobs._lock_key("test", subject)
+
+        # The lock expired while the job ran and a retry took it
+        await r.set(lock, "retry-job", ex=30)
+        done.set()
+        await asyncio.gather(*jobs._tasks)
+
+        assert (await jobs.get(job["id"]))["status"] == "succeeded"
+        # Neither refreshed nor released by the first job
+        assert await r.get(lock) == "retry-job"
+        assert await r.ttl(lock) <= 30
+
+    run(scenario())
@@ -0,0 +1,49 @@
+from textblob import TextBlob
+import sentiment
+
+CORPUS = [
+    "",
+    "   ",
+    "I love this set!",
+    "I don't love this set.",
+    "This is not bad at all",
+    "not very good",
+    "very very good",
+    "extremely disappointing build",
+    "The instructions were really terrible :(",
+    "Amazing!!! :) :D",
+    "meh (!)",
+    "GREAT bricks, AWFUL box",
+    "It's okay, I guess... not the best, not the worst.",
+    "Absolutely fantastic! The Millennium Falcon exceeded my expectations.",
+    "no scoring words here 12345",
+    "Perfect 😍 set, but the stickers are horrible 😡",
+    "I was hardly impressed; it's slightly too small.",
+]
+
+
+def test_polarities_match_textblob():
+    sentiment._memo.clear()
+    expected = [TextBlob(text).sentiment.polarity for text in CORPUS]
+    assert list(sentiment.polarities(CORPUS)) == expected
+    # And again from the memo
+    assert list(sentiment.polarities(CORPUS)) == expected
+    assert [sentiment.polarity(text) for text in CORPUS] == expected
+
+
+def test_repeated_texts_are_scored_once(monkeypatch):
+    sentiment._memo.clear()
+    scored = []
+    score_unique = sentiment._score_unique
+
+    def counting(texts):
+        scored.extend(texts)
+        return score_unique(texts)
+
+    monkeypatch.setattr(sentiment, "_score_unique", counting)
+    first = sentiment.polarities(["great set", "great set", "awful set"])
+    assert sorted(scored) == ["awful set", "great set"]
+
+    again = sentiment.polarities(["awful set", "great set"])
+    assert sorted(scored) == ["awful set", "great set"]
+    assert list(again) == [first[2], first[0]]
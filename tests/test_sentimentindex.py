@@ -0,0 +1,41 @@
+from rediscache import async_redis_client as r
+import sentimentindex
+import time
+import uuid
+
+
+def test_comment_is_counted_once(run):
+    async def scenario():
+        legoset_id = str(uuid.uuid4())
+        # Recorded by the API, then delivered (twice) by the change feed
+        for _ in range(3):
+            await sentimentindex.record_comment(legoset_id, "comment-1", 0.5, "Set")
+        await sentimentindex.record_comment(legoset_id, "comment-2", -0.1, "Set")
+
+        stats = await r.hgetall(sentimentindex.stats_key(legoset_id))
+        assert int(stats["count"]) == 2
+        assert float(stats["sum"]) == 0.4
+
+    run(scenario())
+
+
+def test_counted_comments_are_bounded_to_the_window(run, monkeypatch):
+    monkeypatch.setattr(sentimentindex, "DEDUPE_WINDOW", 60)
+
+    async def scenario():
+        legoset_id = str(uuid.uuid4())
+        counted = sentimentindex.counted_key(legoset_id)
+        now = time.time()
+        await sentimentindex.record_comment(legoset_id, "old", 0.5, "Set", created=now - 50)
+        await sentimentindex.record_comment(legoset_id, "new", 0.5, "Set", created=now)
+        assert await r.zcard(counted) == 2
+        assert 0 < await r.ttl(counted) <= 60
+
+        # Later, "old" left the window: it is trimmed, and taken as counted if delivered again
+        monkeypatch.setattr(sentimentindex.time, "time", lambda: now + 20)
+        await sentimentindex.record_comment(legoset_id, "newer", 0.5, "Set", created=now + 20)
+        await sentimentindex.record_comment(legoset_id, "old", 0.5, "Set", created=now - 50)
+        assert await r.zrange(counted, 0, -1) == ["new", "newer"]
+        assert int(await r.hget(sentimentindex.stats_key(legoset_id), "count")) == 3
+
+    run(scenario())
@@ -1,6 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+import asyncio
+import os
+import time
+
+# Argon2 cost, applied to new hashes; existing hashes carry their own parameters.
+# Every hash in flight allocates MEMORY_COST KiB, so HASH_WORKERS * MEMORY_COST
+# has to fit in the pod's memory limit.
+TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "102400"))  # KiB
+PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "8"))
+# At most HASH_WORKERS hashes run at once; beyond HASH_MAX_QUEUE waiting ones
+# callers get PasswordHashingBusy instead of piling up
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=TIME_COST,
+    argon2__memory_cost=MEMORY_COST,
+    argon2__parallelism=PARALLELISM,
+)
+
+_pool = None
+_in_flight = 0
+
+stats = {
+    "hashed": 0, "verified": 0, "rejected": 0, "failed": 0,
+    "max_queue_depth": 0, "wait_seconds": 0.0, "hash_seconds": 0.0,
+}
+
+
+class PasswordHashingBusy(Exception):
+    pass
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 
 def hash_password(password: str):
     hashed_password = pwd_context.hash(password)
@@ -8,4 +42,74 @@ def hash_password(password: str):
 
 def verify_password(password, hashed_password):
     is_valid = pwd_context.verify(password, hashed_password)
-    return is_valid
\ No newline at end of file
+    return is_valid
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        # argon2-cffi releases the GIL while hashing, so threads run in parallel.
+        # A pool of its own keeps signups from taking the threadpool that sync
+        # endpoints and run_in_threadpool share.
+        _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="argon2")
+    return _pool
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    return start, function(*args), time.perf_counter()
+
+
+async def _run(function, *args):
+    global _in_flight
+    if _in_flight - HASH_WORKERS >= HASH_MAX_QUEUE:
+        stats["rejected"] += 1
+        raise PasswordHashingBusy("Too many password hashes queued")
+    _in_flight += 1
+    stats["max_queue_depth"] = max(stats["max_queue_depth"], _in_flight - HASH_WORKERS)
+    submitted = time.perf_counter()
+    try:
+        start, result, end = await asyncio.get_running_loop().run_in_executor(get_pool(), _timed, function, *args)
+    except Exception:
+        stats["failed"] += 1
+        raise
+    finally:
+        _in_flight -= 1
+    stats["wait_seconds"] += start - submitted
+    stats["hash_seconds"] += end - start
+    return result
+
+
+async def hash_password_async(password: str) -> str:
+    result = await _run(hash_password, password)
+    stats["hashed"] += 1
+    return result
+
+
+async def verify_password_async(password, hashed_password) -> bool:
+    result = await _run(verify_password, password, hashed_password)
+    stats["verified"] += 1
+    return result
+
+
+def snapshot() -> dict:
+    completed = stats["hashed"] + stats["verified"]
+    return {
+        **stats,
+        "workers": HASH_WORKERS,
+        "max_queue": HASH_MAX_QUEUE,
+        "in_flight": _in_flight,
+        "queue_depth": max(0, _in_flight - HASH_WORKERS),
+        "avg_wait_ms": stats["wait_seconds"] / completed * 1000 if completed else None,
+        "avg_hash_ms": stats["hash_seconds"] / completed * 1000 if completed else None,
+        "time_cost": TIME_COST,
+        "memory_cost": MEMORY_COST,
+        "parallelism": PARALLELISM,
+    }
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None